@@ -0,0 +1,195 @@
+"""
+Ape-X style training: actor processes play and a learner process trains.
+
+Every actor runs its own Game with its own epsilon and streams chunks of
+transitions to the learner over a queue. The learner keeps one replay
+shard per actor, so every shard holds the unbroken frame stream of one
+game, trains on batches drawn from all of them and sends the network
+weights back to the actors every SYNC_EVERY steps.
+
+    python -m gameai.flappy_bird.ai.apex --actors 4
+"""
+import argparse
+import queue
+import time
+import multiprocessing as mp
+import numpy as np
+from loguru import logger
+
+from gameai.flappy_bird.ai.preprocess import FramePreprocessor, FrameStack
+from gameai.flappy_bird.ai.replay import ReplayMemory
+from gameai.flappy_bird.ai.checkpoint import AsyncCheckpointer, snapshot_variables
+
+ACTORS = 4            # number of actor processes
+ACTIONS = 2           # number of valid actions
+BASE_EPSILON = 0.4    # epsilon of the first actor
+EPSILON_ALPHA = 7     # spread of the actor epsilons
+OBSERVE = 1000        # transitions to receive before training
+REPLAY_MEMORY = 50000 # transitions kept over all actors
+BATCH = 32            # size of minibatch
+CHUNK = 50            # transitions per message from an actor
+QUEUE_SIZE = 64       # messages waiting for the learner before actors block
+MAX_DRAIN = 16        # messages the learner takes in between two training steps
+SYNC_EVERY = 400      # training steps between two weight broadcasts
+SAVE_EVERY = 10000    # training steps between two saves
+LOG_EVERY = 1000      # training steps between two log lines
+
+
+def actor_epsilon(i, num_actors):
+    """epsilon of actor i, from BASE_EPSILON down to BASE_EPSILON ** (1 + EPSILON_ALPHA)"""
+    if num_actors == 1:
+        return BASE_EPSILON
+    return BASE_EPSILON ** (1 + EPSILON_ALPHA * i / (num_actors - 1))
+
+
+def actor(actor_id, epsilon, transitions, weights, seed=None):
+    """plays forever, sending (actor_id, start frame or None, frames, actions, rewards, terminals) chunks"""
+    # the processes are spawned, tensorflow and pygame are only loaded here
+    import tensorflow as tf
+    from gameai.flappy_bird.ai.dqn import DeepQN
+    from gameai.flappy_bird.game.run import Game
+    from gameai.flappy_bird.game.settings import AssetManager
+
+    np.random.seed(seed)
+    # one thread each, the actors already use all the cores together
+    brain = DeepQN(config=tf.ConfigProto(intra_op_parallelism_threads=1, inter_op_parallelism_threads=1))
+    brain.set_weights(weights.get())
+    game_state = Game(fps=None, show_every=0, obs_mode='gray', assets=AssetManager(audio=False), seed=seed)
+    preprocess = FramePreprocessor()
+    frames = FrameStack()
+
+    frame_buf = np.zeros((CHUNK, 80, 80), dtype=np.uint8)
+    action_buf = np.zeros(CHUNK, dtype=np.int8)
+    reward_buf = np.zeros(CHUNK, dtype=np.float32)
+    terminal_buf = np.zeros(CHUNK, dtype=bool)
+    a_t = np.zeros(ACTIONS)
+
+    a_t[0] = 1
+    x_t, _, _ = game_state.frame_step(a_t)
+    x_t = preprocess(x_t)
+    s_t = frames.reset(x_t)
+    start = x_t.copy()
+    n = 0
+    while True:
+        action = brain.act_batch(s_t[None], epsilon)[0]
+        a_t[:] = 0
+        a_t[action] = 1
+        x_t1, r_t, terminal = game_state.frame_step(a_t)
+        x_t1 = preprocess(x_t1)
+        s_t = frames.push(x_t1)
+
+        frame_buf[n] = x_t1
+        action_buf[n] = action
+        reward_buf[n] = r_t
+        terminal_buf[n] = terminal
+        n += 1
+        if n == CHUNK:
+            # the queue pickles in a background thread, send copies
+            transitions.put((actor_id, start, frame_buf.copy(), action_buf.copy(),
+                             reward_buf.copy(), terminal_buf.copy()))
+            start = None
+            n = 0
+            try:
+                brain.set_weights(weights.get_nowait())
+            except queue.Empty:
+                pass
+
+
+def broadcast(brain, weights):
+    """sends the learner's weights to every actor, replacing the ones not picked up yet"""
+    params = brain.get_weights()
+    for q in weights:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            q.put_nowait(params)
+        except queue.Full:
+            # the old weights were not flushed to the pipe yet, the next broadcast catches up
+            pass
+
+
+def receive(transitions, shards, block=False):
+    """moves waiting chunks into the actors' shards, returns the number of transitions"""
+    received = 0
+    for _ in range(MAX_DRAIN):
+        try:
+            actor_id, start, frames, actions, rewards, terminals = transitions.get(block=block)
+        except queue.Empty:
+            break
+        block = False
+        shard = shards[actor_id]
+        if start is not None:
+            shard.start(start)
+        for i in range(len(frames)):
+            shard.add(frames[i], actions[i], rewards[i], terminals[i])
+        received += len(frames)
+    return received
+
+
+def sample_shards(shards, samples_num, rng):
+    """samples a batch over the shards, each in proportion to the transitions it holds"""
+    sizes = np.array([max(0, len(shard) - shard.history) for shard in shards], dtype=np.float64)
+    counts = rng.multinomial(samples_num, sizes / sizes.sum())
+    parts = [shard.sample(int(k)) for shard, k in zip(shards, counts) if k > 0]
+    return [np.concatenate(field) for field in zip(*parts)]
+
+
+def learner(num_actors=ACTORS):
+    from gameai.flappy_bird.ai.dqn import DeepQN
+
+    # spawn, not fork: every actor starts its own tensorflow and pygame
+    ctx = mp.get_context('spawn')
+    transitions = ctx.Queue(maxsize=QUEUE_SIZE)
+    weights = [ctx.Queue(maxsize=1) for _ in range(num_actors)]
+    actors = [
+        ctx.Process(target=actor, args=(i, actor_epsilon(i, num_actors), transitions, weights[i]),
+                    kwargs={'seed': i}, daemon=True)
+        for i in range(num_actors)
+    ]
+    for p in actors:
+        p.start()
+
+    brain = DeepQN()
+    checkpointer = AsyncCheckpointer(prefix='apex')
+    checkpoint = checkpointer.restore(brain.sess)
+    t = 0
+    if checkpoint is not None:
+        t = checkpoint['step']
+        logger.info(f"Resumed from {checkpoint['file']}")
+    broadcast(brain, weights)
+    shards = [ReplayMemory(REPLAY_MEMORY // num_actors) for _ in range(num_actors)]
+    rng = np.random.default_rng()
+
+    received = 0
+    last_time, last_received = time.time(), 0
+    try:
+        while True:
+            # wait for the actors while there is too little to train on
+            received += receive(transitions, shards, block=received < OBSERVE)
+            if received < OBSERVE:
+                continue
+
+            q_max, _ = brain.train_batch(sample_shards(shards, BATCH, rng))
+            t += 1
+            if t % SYNC_EVERY == 0:
+                broadcast(brain, weights)
+            if t % SAVE_EVERY == 0:
+                checkpointer.save(t, snapshot_variables(brain.sess))
+            if t % LOG_EVERY == 0:
+                now = time.time()
+                logger.info(f'TRAIN STEP {t} / TRANSITIONS {received} / '
+                            f'{(received - last_received) / (now - last_time):.0f} transitions/s / '
+                            f'{LOG_EVERY / (now - last_time):.1f} steps/s / Q_MAX {q_max:e}')
+                last_time, last_received = now, received
+    finally:
+        for p in actors:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Ape-X style DQN training")
+    parser.add_argument("--actors", type=int, default=ACTORS, help="number of actor processes")
+    args = parser.parse_args()
+    learner(args.actors)
@@ -1,48 +1,62 @@
-import json
+import os
 import sys
 import argparse
+import numpy as np
 from gameai.flappy_bird.game.run import Game, logger
-from gameai.flappy_bird.game.settings import PLAYER_HEIGHT
+from gameai.flappy_bird.game.core import PLAYER_HEIGHT
+from gameai.flappy_bird.ai.qtable import QTable, STATES, QVALUES_PATH, QVALUES_JSON, POLICY_PATH, state_index, \
+    state_indices, state_buckets, backward_sweep, save_policy, load_policy
 
-parser = argparse.ArgumentParser("learn.py")
-parser.add_argument("--iter", type=int, default=1000,
-                    help="number of iterations to run")
-parser.add_argument("-d", "--daemon", type=bool, default=False,
-                    help="run in daemon without visualization")
-args = parser.parse_args()
-ITERATIONS = args.iter
-DAMEON = args.daemon
-LEARN_ITERATIONS = args.iter
+ITERATIONS = 1000
+DAMEON = False
+LEARN_ITERATIONS = 1000
+
+
+def load_qtable():
+    """
+    Load the Q-table from the binary file, converting the JSON file the first time
+    """
+    if os.path.exists(QVALUES_PATH):
+        return QTable.load(QVALUES_PATH)
+    try:
+        qtable = QTable.load_json(QVALUES_JSON)
+    except IOError:
+        qtable = QTable()
+    qtable.save(QVALUES_PATH)
+    return qtable
 
 
 class Bot(object):
     """
     The Bot class that applies the Qlearning logic to Flappy bird game
     After every iteration (iteration = 1 game that ends with the bird dying) updates Q values
-    After every DUMPING_N iterations, dumps the Q values to the local JSON file
+    After every DUMPING_N iterations, logs the changed Q values to the local binary file
+
+    qtable: QTable to learn on instead of the one on disk
     """
-    def __init__(self):
+    def __init__(self, qtable=None):
         self.gameCNT = 0  # Game count of current run, incremented after every death
         self.DUMPING_N = 25  # Number of iterations to dump Q values to JSON after
         self.discount = 1.0
         self.r = {0: 1, 1: -1000}  # Reward function
         self.lr = 0.7
-        self.load_qvalues()
-        self.last_state = "420_240_0"
+        self.load_qvalues(qtable)
+        self.last_state = state_index(420, 240, 0)
         self.last_action = 0
-        self.moves = []
+        # history of the episode, rows of (state, action, next state), grown as needed
+        self.moves = np.zeros((1024, 3), dtype=np.int64)
+        self.n_moves = 0
 
-    def load_qvalues(self):
+    def load_qvalues(self, qtable=None):
         """
-        Load q values from a JSON file
+        Load q values, see load_qtable. Rows of self.qvalues are indexed by state
         """
-        self.qvalues = {}
-        try:
-            fil = open("data/qvalues.json", "r")
-        except IOError:
-            return
-        self.qvalues = json.load(fil)
-        fil.close()
+        self.qtable = qtable if qtable is not None else load_qtable()
+        self.qvalues = self.qtable.values
+        # states updated since the last dump
+        self.dirty = np.zeros(STATES, dtype=bool)
+        # number of updates of each (state, action), to weight merges of tables
+        self.visits = np.zeros(self.qvalues.shape, dtype=np.int64)
 
     def act(self, xdif, ydif, vel):
         """
@@ -50,13 +64,16 @@ class Bot(object):
         """
         state = self.map_state(xdif, ydif, vel)
 
-        self.moves.append(
-            (self.last_state, self.last_action, state)
-        )  # Add the experience to the history
+        # Add the experience to the history
+        if self.n_moves == len(self.moves):
+            self.moves = np.concatenate((self.moves, np.zeros_like(self.moves)))
+        self.moves[self.n_moves] = (self.last_state, self.last_action, state)
+        self.n_moves += 1
 
         self.last_state = state  # Update the last_state with the current state
 
-        if self.qvalues[state][0] >= self.qvalues[state][1]:
+        q = self.qvalues[state]
+        if q[0] >= q[1]:
             self.last_action = 0
             return 0
         else:
@@ -65,105 +82,185 @@ class Bot(object):
 
     def update_scores(self, dump_qvalues=True):
         """
-        Update qvalues via iterating over experiences
+        Update qvalues via a backward sweep over the experiences
         """
-        history = list(reversed(self.moves))
+        moves = self.moves[:self.n_moves]
+        states, actions, next_states = moves[:, 0], moves[:, 1], moves[:, 2]
 
-        # Flag if the bird died in the top pipe
-        try:
-            state = history[0][2]
-            ydif = state.split("_")[1]
-            high_death_flag = True if int(ydif) > 120 else False
-        except Exception as e:
-            print(e)
+        # Select reward: death for the last two moves, alive for the others
+        rewards = np.full(len(moves), self.r[0], dtype=np.float64)
+        rewards[-2:] = self.r[1]
+        # Flag if the bird died in the top pipe: the last flap before those two moves is a death too
+        if len(moves) and state_buckets(next_states[-1])[1] > 120:
+            flaps = np.flatnonzero(actions[:-2])
+            if len(flaps):
+                rewards[flaps[-1]] = self.r[1]
 
         # Q-learning score updates
-        t = 1
-        for exp in history:
-            state = exp[0]
-            act = exp[1]
-            res_state = exp[2]
-
-            # Select reward
-            if t == 1 or t == 2:
-                cur_reward = self.r[1]
-            elif high_death_flag and act:
-                cur_reward = self.r[1]
-                high_death_flag = False
-            else:
-                cur_reward = self.r[0]
-
-            # Update
-            self.qvalues[state][act] = (1-self.lr) * (self.qvalues[state][act]) + \
-                                       self.lr * ( cur_reward + self.discount*max(self.qvalues[res_state]) )
-
-            t += 1
+        backward_sweep(self.qvalues, states, actions, next_states, rewards, self.lr, self.discount)
+        self.dirty[states] = True
+        np.add.at(self.visits, (states, actions), 1)
 
         self.gameCNT += 1  # increase game count
         if dump_qvalues:
             self.dump_qvalues()  # Dump q values (if game count % DUMPING_N == 0)
-        self.moves = []  # clear history after updating strategies
+        self.n_moves = 0  # clear history after updating strategies
 
     def map_state(self, xdif, ydif, vel):
         """
         Map the (xdif, ydif, vel) to the respective state, with regards to the grids
-        The state is a string, "xdif_ydif_vel"
+        The state is the int index of the grid cell, see qtable.state_index
 
         X -> [-40,-30...120] U [140, 210 ... 420]
         Y -> [-300, -290 ... 160] U [180, 240 ... 420]
         """
-        if xdif < 140:
-            xdif = int(xdif) - (int(xdif) % 10)
-        else:
-            xdif = int(xdif) - (int(xdif) % 70)
-
-        if ydif < 180:
-            ydif = int(ydif) - (int(ydif) % 10)
-        else:
-            ydif = int(ydif) - (int(ydif) % 60)
-
-        return str(int(xdif)) + "_" + str(int(ydif)) + "_" + str(vel)
+        return state_index(xdif, ydif, vel)
 
     def dump_qvalues(self, force=False):
         """
-        Dump the qvalues to the JSON file
+        Dump the qvalues to the binary file, appending only the updated states
+        to its delta log unless forced
         """
         if self.gameCNT % self.DUMPING_N == 0 or force:
-            fil = open("data/qvalues.json", "w")
-            json.dump(self.qvalues, fil)
-            fil.close()
+            if force:
+                self.qtable.save(QVALUES_PATH)
+            else:
+                self.qtable.append_log(np.flatnonzero(self.dirty), QVALUES_PATH)
+            self.dirty[:] = False
             print("Q-values updated on local file.")
 
 
-def bot_play_game():
+class FrozenBot(object):
+    """
+    Plays the greedy policy of a trained Q-table without learning: no
+    history is kept and every act is one lookup in a uint8 action table.
+
+    policy: (STATES,) action table, see QTable.greedy_policy, frozen from
+            the table on disk when None
+    """
+    def __init__(self, policy=None):
+        self.policy = policy if policy is not None else load_qtable().greedy_policy()
+
+    @classmethod
+    def load(cls, path=POLICY_PATH):
+        return cls(load_policy(path))
+
+    def act(self, xdif, ydif, vel):
+        return int(self.policy[state_index(xdif, ydif, vel)])
+
+    def act_batch(self, xdif, ydif, vel):
+        """actions of arrays of states"""
+        return self.policy[state_indices(xdif, ydif, vel)]
+
+
+def evaluate_policy(bot, games=1000, num_envs=1024, max_score=10000, seed=None):
+    """
+    Scores of `games` games of a FrozenBot, played in lockstep on a VectorGame.
+    Every environment plays its fixed share of the games, so short games are
+    not over represented. A game is stopped and scored max_score once it
+    reaches it.
+    """
+    from gameai.flappy_bird.game.vector import VectorGame
+
+    num_envs = min(num_envs, games)
+    game = VectorGame(num_envs, seed=seed)
+    quota = np.full(num_envs, games // num_envs)
+    quota[:games % num_envs] += 1
+    played = np.zeros(num_envs, dtype=np.int64)
+    scores = []
+    while (played < quota).any():
+        # the bird aims at the first pipe until it is 30 pixels behind
+        pipe = (game.pipe_x[:, 0] - game.playerx <= -30).astype(np.int64)
+        rows = np.arange(num_envs)
+        actions = bot.act_batch(game.pipe_x[rows, pipe] - game.playerx,
+                                game.lower_pipe_y[rows, pipe] - game.playery, game.playerVelY)
+        _, terminal = game.step(actions)
+
+        capped = ~terminal & (game.score >= max_score)
+        game.final_score[capped] = max_score
+        game.reset(capped)
+        done = (terminal | capped) & (played < quota)
+        scores.append(game.final_score[done])
+        played[terminal | capped] += 1
+    return np.concatenate(scores)
+
+
+def bot_step(game, bot):
+    """
+    Plays one frame of the game with the bot's action, returns True when the bird died
+    """
+    if -game.playerx + game.lowerPipes[0]["x"] > -30:
+        myPipe = game.lowerPipes[0]
+    else:
+        myPipe = game.lowerPipes[1]
+
+    # do not JUMP
+    input_actions = [1, 0]
+    curr_action = bot.act(-game.playerx + myPipe["x"], -game.playery + myPipe["y"], game.playerVelY)
+    if curr_action and game.playery > -2 * PLAYER_HEIGHT:
+        # JUMP
+        input_actions = [0, 1]
+
+    x_t, r_t, terminal = game.frame_step(input_actions)
+    return terminal
+
+
+def bot_play_game(seed=None, record=None):
+    """
+    seed: seed of the game
+    record: path to save a recording of the games to, see game.record
+    """
     # 打开游戏状态与模拟器进行通信
-    game = Game(daemon=DAMEON)
+    if record:
+        from gameai.flappy_bird.game.record import Recorder
+        game = Recorder(seed=seed if seed is not None else int.from_bytes(os.urandom(4), 'little'),
+                        daemon=DAMEON)
+    else:
+        game = Game(daemon=DAMEON, seed=seed)
     # Qlearning game bot
     bot = Bot()
 
-    while True:
-        if -game.playerx + game.lowerPipes[0]["x"] > -30:
-            myPipe = game.lowerPipes[0]
-        else:
-            myPipe = game.lowerPipes[1]
-
-        # do not JUMP
-        input_actions = [1, 0]
-        curr_action = bot.act(-game.playerx + myPipe["x"], -game.playery + myPipe["y"], game.playerVelY)
-        if curr_action and game.playery > -2 * PLAYER_HEIGHT:
-            # JUMP
-            input_actions = [0, 1]
-
-        x_t, r_t, terminal = game.frame_step(input_actions)
-        if terminal:
-            # Update the q scores
-            dump_qvalues = True if bot.gameCNT % 100 == 0 else False
-            bot.update_scores(dump_qvalues=dump_qvalues)
+    try:
+        while True:
+            terminal = bot_step(game, bot)
+            if terminal:
+                # Update the q scores
+                dump_qvalues = True if bot.gameCNT % 100 == 0 else False
+                bot.update_scores(dump_qvalues=dump_qvalues)
 
-        if bot.gameCNT == LEARN_ITERATIONS:
-            bot.dump_qvalues(force=True)
-            exit()
+            if bot.gameCNT == LEARN_ITERATIONS:
+                bot.dump_qvalues(force=True)
+                exit()
+    finally:
+        # also when the run crashes or is interrupted, to replay what led to it
+        if record:
+            game.save(record)
 
 
 if __name__ == '__main__':
-    bot_play_game()
\ No newline at end of file
+    parser = argparse.ArgumentParser("learn.py")
+    parser.add_argument("--iter", type=int, default=1000,
+                        help="number of iterations to run")
+    parser.add_argument("-d", "--daemon", type=bool, default=False,
+                        help="run in daemon without visualization")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the game")
+    parser.add_argument("--record", default=None, metavar="PATH",
+                        help="save a recording of the games to PATH, see game.record")
+    parser.add_argument("--freeze", action="store_true",
+                        help="save the greedy policy of the Q-table to data/policy.npz and exit")
+    parser.add_argument("--evaluate", type=int, default=0, metavar="GAMES",
+                        help="score the frozen policy over GAMES headless games and exit")
+    args = parser.parse_args()
+    if args.freeze:
+        save_policy(load_qtable().greedy_policy(), POLICY_PATH)
+        sys.exit()
+    if args.evaluate:
+        bot = FrozenBot.load() if os.path.exists(POLICY_PATH) else FrozenBot()
+        scores = evaluate_policy(bot, args.evaluate)
+        logger.info(f'{len(scores)} games: mean score {scores.mean():.1f}, '
+                    f'median {np.median(scores):.0f}, max {scores.max()}')
+        sys.exit()
+    ITERATIONS = args.iter
+    DAMEON = args.daemon
+    LEARN_ITERATIONS = args.iter
+    bot_play_game(args.seed, args.record)
\ No newline at end of file
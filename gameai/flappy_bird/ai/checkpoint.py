@@ -0,0 +1,184 @@
+"""
+Checkpoints written in the background.
+
+Saving only takes a snapshot of the variables, one sess.run, and of the
+replay memory; a writer thread serializes them to npz files while training
+goes on. Only the last `keep` checkpoints and the best scoring one are kept.
+"""
+import os
+import json
+import queue
+import threading
+import numpy as np
+from loguru import logger
+
+SAVE_DIR = 'saved_networks'  # where every trainer keeps its checkpoints
+KEEP = 5                     # number of recent checkpoints to keep
+
+
+def snapshot_variables(sess):
+    """values of all the global variables, by name"""
+    import tensorflow as tf
+    variables = tf.global_variables()
+    return dict(zip((v.name for v in variables), sess.run(variables)))
+
+
+def load_variables(sess, values):
+    import tensorflow as tf
+    for v in tf.global_variables():
+        if v.name in values:
+            v.load(values[v.name], sess)
+
+
+def _atomic_save(path, write):
+    """write(f) to a temporary file moved over `path`, so readers never see half a file"""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def read_checkpoints(directory=SAVE_DIR, prefix='dqn'):
+    """the kept checkpoints of `prefix` in `directory`, oldest first, read from the index only"""
+    try:
+        with open(os.path.join(directory, f'{prefix}-checkpoints.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def latest_checkpoint(directory=SAVE_DIR, prefix='dqn', best=False):
+    """index entry of the latest checkpoint, or of the best scoring one, None if there is none"""
+    checkpoints = read_checkpoints(directory, prefix)
+    if best:
+        checkpoints = [c for c in checkpoints if c['score'] is not None] or checkpoints
+        checkpoints.sort(key=lambda c: c['score'] if c['score'] is not None else -np.inf)
+    return checkpoints[-1] if checkpoints else None
+
+
+class AsyncCheckpointer(object):
+    """
+    Writes checkpoints named `prefix`-<step>.npz to `directory` from a
+    background thread.
+
+    The index `prefix`-checkpoints.json lists the kept checkpoints with
+    their step, score and the trainer's state, e.g. epsilon. The replay
+    memory goes to `prefix`-replay.npz, one file overwritten each time with
+    the step it was saved at. Only that step's entry is marked as having a
+    replay, and it is only restored with the checkpoint of that step.
+    """
+    def __init__(self, directory=SAVE_DIR, prefix='dqn', keep=KEEP) -> None:
+        self.directory = directory
+        self.prefix = prefix
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+        # one checkpoint waiting while the previous one is written
+        self.pending = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, f'{self.prefix}-checkpoints.json')
+
+    @property
+    def replay_path(self):
+        return os.path.join(self.directory, f'{self.prefix}-replay.npz')
+
+    def checkpoints(self):
+        """the kept checkpoints, oldest first"""
+        return read_checkpoints(self.directory, self.prefix)
+
+    def save(self, step, variables, state=None, score=None, replay=None):
+        """
+        queues a checkpoint and returns, blocks only while an older one waits
+
+        variables: {name: array}, see snapshot_variables
+        state: JSON values to resume with, e.g. epsilon
+        score: evaluation score, the best checkpoint is kept
+        replay: ReplayMemory to save along
+        """
+        replay_snapshot = replay.snapshot() if replay is not None else None
+        self.pending.put((step, variables, state or {}, score, replay_snapshot))
+
+    def wait(self):
+        """blocks until every queued checkpoint is written"""
+        self.pending.join()
+
+    def close(self):
+        self.wait()
+        self.pending.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                return
+            try:
+                self._write(*item)
+            except Exception:
+                logger.exception(f'Failed to write checkpoint {item[0]}')
+            finally:
+                self.pending.task_done()
+
+    def _write(self, step, variables, state, score, replay_snapshot):
+        name = f'{self.prefix}-{step}.npz'
+        _atomic_save(os.path.join(self.directory, name), lambda f: np.savez(f, **variables))
+        if replay_snapshot is not None:
+            _atomic_save(self.replay_path, lambda f: np.savez(f, step=np.array(step), **replay_snapshot))
+
+        checkpoints = [c for c in self.checkpoints() if c['step'] != step]
+        if replay_snapshot is not None:
+            # the replay file of the older checkpoints was just overwritten
+            for c in checkpoints:
+                c['replay'] = False
+        checkpoints.append({'step': step, 'file': name, 'score': score, 'state': state,
+                            'replay': replay_snapshot is not None})
+        checkpoints = self._retain(checkpoints)
+        _atomic_save(self.index_path, lambda f: f.write(json.dumps(checkpoints, indent=1).encode()))
+
+    def _retain(self, checkpoints):
+        """keeps the last `keep` checkpoints and the best scoring one, deletes the files of the others"""
+        checkpoints.sort(key=lambda c: c['step'])
+        kept = checkpoints[-self.keep:]
+        scored = [c for c in checkpoints if c['score'] is not None]
+        if scored:
+            best = max(scored, key=lambda c: c['score'])
+            if best not in kept:
+                kept.insert(0, best)
+        for c in checkpoints:
+            if c not in kept:
+                try:
+                    os.remove(os.path.join(self.directory, c['file']))
+                except FileNotFoundError:
+                    pass
+        return kept
+
+    def latest(self, best=False):
+        """index entry of the latest checkpoint, or of the best scoring one, None if there is none"""
+        return latest_checkpoint(self.directory, self.prefix, best)
+
+    def path(self, checkpoint):
+        return os.path.join(self.directory, checkpoint['file'])
+
+    def restore(self, sess, replay=None, best=False):
+        """
+        loads the latest checkpoint, or the best scoring one, into the
+        session, and into the replay memory when the replay file was saved
+        with it. returns its index entry, None if there is none.
+        """
+        checkpoint = self.latest(best)
+        if checkpoint is None:
+            return None
+        with np.load(self.path(checkpoint)) as values:
+            load_variables(sess, values)
+        if replay is not None and checkpoint['replay'] and os.path.exists(self.replay_path):
+            with np.load(self.replay_path) as snapshot:
+                # a crash in between writing the replay and the index leaves a newer replay
+                if 'step' in snapshot.files and int(snapshot['step']) == checkpoint['step']:
+                    replay.restore(snapshot)
+                else:
+                    logger.warning(f"{self.replay_path} is not the replay of {checkpoint['file']}, not restored")
+        return checkpoint
@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 from __future__ import print_function
-from collections import deque
 import numpy as np
 import random
 from gameai.flappy_bird.game.run import Game
+from gameai.flappy_bird.ai.preprocess import FramePreprocessor, FrameStack
+from gameai.flappy_bird.ai.replay import ReplayMemory, MemmapReplayMemory
+from gameai.flappy_bird.ai.checkpoint import AsyncCheckpointer, snapshot_variables
 
 import tensorflow as tf
 import cv2
@@ -19,8 +21,13 @@ EXPLORE = 3000000.  # frames over which to anneal epsilon
 FINAL_EPSILON = 0.0001  # final value of epsilon
 INITIAL_EPSILON = 0.1   # starting value of epsilon
 REPLAY_MEMORY = 50000   # number of previous transitions to remember
+REPLAY_DIR = None       # directory to memory-map the replay memory to, kept across runs; None keeps it in RAM
 BATCH = 32              # size of minibatch
 FRAME_PER_ACTION = 1
+RENDER_FPS = None       # frame rate cap of the window, None for full speed
+SHOW_EVERY = 100        # show every Kth frame in the window, 0 to render off-screen only
+SAVE_EVERY = 10000      # timesteps between two checkpoints
+RESUME = True           # continue from the latest checkpoint in saved_networks
 
 
 def weight_variable(shape):
@@ -84,44 +91,62 @@ def createNetwork():
 
 def trainNetwork(s, readout, h_fc1, sess):
     # define the cost function
+    # s is fed the states followed by the next states, the bellman target is
+    # computed in the graph from the second half
     a = tf.placeholder("float", [None, ACTIONS])
-    y = tf.placeholder("float", [None])
+    r = tf.placeholder("float", [None])
+    terminal_mask = tf.placeholder("float", [None])
+    batch = tf.shape(r)[0]
+    readout_j, readout_j1 = readout[:batch], readout[batch:]
+    # if terminal, only equals reward
+    y = tf.stop_gradient(r + GAMMA * (1. - terminal_mask) * tf.reduce_max(readout_j1, axis=1))
     readout_action = tf.reduce_sum(
-        tf.multiply(readout, a), reduction_indices=1)
+        tf.multiply(readout_j, a), reduction_indices=1)
     cost = tf.reduce_mean(tf.square(y - readout_action))
     train_step = tf.train.AdamOptimizer(1e-6).minimize(cost)
 
     # open up a game state to communicate with emulator
-    game_state = Game()
+    game_state = Game(fps=RENDER_FPS, show_every=SHOW_EVERY, obs_mode='gray')
+    preprocess = FramePreprocessor()
+    frames = FrameStack()
 
     # store the previous observations in replay memory
-    D = deque()
+    if REPLAY_DIR:
+        D = MemmapReplayMemory(REPLAY_DIR, REPLAY_MEMORY)
+    else:
+        D = ReplayMemory(REPLAY_MEMORY)
 
     # printing
     a_file = open("logs_" + GAME + "/readout.txt", 'w')
     h_file = open("logs_" + GAME + "/hidden.txt", 'w')
 
+    # saving and loading networks, checkpoints are written in the background
+    sess.run(tf.initialize_all_variables())
+    checkpointer = AsyncCheckpointer(prefix=GAME + '-dqn')
+    epsilon = INITIAL_EPSILON
+    t = 0
+    checkpoint = checkpointer.restore(sess, D) if RESUME else None
+    if checkpoint is not None:
+        epsilon = checkpoint['state']['epsilon']
+        t = checkpoint['step']
+        print("Successfully loaded:", checkpoint['file'])
+    else:
+        print("Could not find old network weights")
+
     # get the first state by doing nothing and preprocess the image to 80x80x4
     do_nothing = np.zeros(ACTIONS)
     do_nothing[0] = 1
     x_t, r_0, terminal = game_state.frame_step(do_nothing)
-    x_t = cv2.cvtColor(cv2.resize(x_t, (80, 80)), cv2.COLOR_BGR2GRAY)
-    ret, x_t = cv2.threshold(x_t, 1, 255, cv2.THRESH_BINARY)
-    s_t = np.stack((x_t, x_t, x_t, x_t), axis=2)
+    x_t = preprocess(x_t)
+    s_t = frames.reset(x_t)
+    # D stores every frame once and rebuilds the stacks when sampling
+    D.start(x_t)
 
-    # saving and loading networks
-    saver = tf.train.Saver()
-    sess.run(tf.initialize_all_variables())
-    checkpoint = tf.train.get_checkpoint_state("saved_networks")
-    # if checkpoint and checkpoint.model_checkpoint_path:
-    #     saver.restore(sess, checkpoint.model_checkpoint_path)
-    #     print("Successfully loaded:", checkpoint.model_checkpoint_path)
-    # else:
-    #     print("Could not find old network weights")
+    # scores of the episodes since the last checkpoint, to keep the best one
+    episode_score = 0
+    scores = []
 
     # start training
-    epsilon = INITIAL_EPSILON
-    t = 0
     while "flappy bird" != "angry bird":
         # choose an action epsilon greedily
         readout_t = readout.eval(feed_dict={s: [s_t]})[0]
@@ -143,46 +168,28 @@ def trainNetwork(s, readout, h_fc1, sess):
             epsilon -= (INITIAL_EPSILON - FINAL_EPSILON) / EXPLORE
 
         # run the selected action and observe next state and reward
-        x_t1_colored, r_t, terminal = game_state.frame_step(a_t)
-        x_t1 = cv2.cvtColor(cv2.resize(
-            x_t1_colored, (80, 80)), cv2.COLOR_BGR2GRAY)
-        ret, x_t1 = cv2.threshold(x_t1, 1, 255, cv2.THRESH_BINARY)
-        x_t1 = np.reshape(x_t1, (80, 80, 1))
-        #s_t1 = np.append(x_t1, s_t[:,:,1:], axis = 2)
-        s_t1 = np.append(x_t1, s_t[:, :, :3], axis=2)
+        x_t1, r_t, terminal = game_state.frame_step(a_t)
+        x_t1 = preprocess(x_t1)
+        s_t1 = frames.push(x_t1)
 
         # store the transition in D
-        D.append((s_t, a_t, r_t, s_t1, terminal))
-        if len(D) > REPLAY_MEMORY:
-            D.popleft()
+        D.add(x_t1, np.argmax(a_t), r_t, terminal)
+        episode_score += r_t == 1
+        if terminal:
+            scores.append(episode_score)
+            episode_score = 0
 
         # only train if done observing
         if t > OBSERVE:
             # sample a minibatch to train on
-            minibatch = random.sample(D, BATCH)
-
-            # get the batch variables
-            s_j_batch = [d[0] for d in minibatch]
-            a_batch = [d[1] for d in minibatch]
-            r_batch = [d[2] for d in minibatch]
-            s_j1_batch = [d[3] for d in minibatch]
-
-            y_batch = []
-            readout_j1_batch = readout.eval(feed_dict={s: s_j1_batch})
-            for i in range(0, len(minibatch)):
-                terminal = minibatch[i][4]
-                # if terminal, only equals reward
-                if terminal:
-                    y_batch.append(r_batch[i])
-                else:
-                    y_batch.append(r_batch[i] + GAMMA *
-                                   np.max(readout_j1_batch[i]))
+            s_j_batch, a_batch, r_batch, s_j1_batch, terminal_batch = D.sample(BATCH)
 
             # perform gradient step
             train_step.run(feed_dict={
-                y: y_batch,
+                r: r_batch,
+                terminal_mask: terminal_batch,
                 a: a_batch,
-                s: s_j_batch}
+                s: np.concatenate((s_j_batch, s_j1_batch))}
             )
 
         # update the old values
@@ -190,8 +197,10 @@ def trainNetwork(s, readout, h_fc1, sess):
         t += 1
 
         # save progress every 10000 iterations
-        if t % 10000 == 0:
-            saver.save(sess, 'saved_networks/' + GAME + '-dqn', global_step=t)
+        if t % SAVE_EVERY == 0:
+            checkpointer.save(t, snapshot_variables(sess), {'epsilon': epsilon},
+                              score=float(np.mean(scores)) if scores else None, replay=D)
+            scores = []
 
         # print info
         state = ""
@@ -1,12 +1,10 @@
-import sys
-sys.path.append('../game')
-
-from run import Game
+from gameai.flappy_bird.game.run import Game
+from gameai.flappy_bird.ai.preprocess import FramePreprocessor, FrameStack
+from gameai.flappy_bird.ai.replay import ReplayMemory, MemmapReplayMemory, PrioritizedReplayMemory
+from gameai.flappy_bird.ai.checkpoint import AsyncCheckpointer, snapshot_variables
 import tensorflow as tf
 import numpy as np
-import cv2
 import sys
-import random
 from loguru import logger
 
 # 游戏名
@@ -18,46 +16,25 @@ EXPLORE = 3.0e6  # 随机探索的时间
 FINAL_EPSILON = 1.0e-4  # 最终的探索率
 INITIAL_EPSILON = 0.1  # 初始探索率
 REPLAY_MEMORY = 50000  # 经验池的大小
+REPLAY_DIR = None  # 经验池的内存映射目录，重启后继续使用；None 为只保存在内存中
+PRIORITIZED = False  # 使用优先经验回放
 BATCH = 32  # mini批的大小
 FRAME_PER_ACTION = 1  # 跳帧
-
-
-
-
-class ExperienceBuffer():
-    """
-    定义经验回报类，完成数据的存储和采样
-    """
-    def __init__(self, buffer_size=REPLAY_MEMORY) -> None:
-        self.buffer = []
-        self.buffer_size = buffer_size
-
-    def add_experience(self, experience):
-        # 截断更早的经验数据
-        if len(self.buffer) + len(experience) >= self.buffer_size:
-            self.buffer[0:len(self.buffer)+len(experience) - self.buffer_size] = []
-        self.buffer.extend(experience)
-
-    def sample(self, samples_num):
-        sample_data = random.sample(self.buffer, samples_num)
-        train_s = [d[0] for d in sample_data]
-        train_a = [d[1] for d in sample_data]
-        train_r = [d[2] for d in sample_data]
-        train_s_ = [d[3] for d in sample_data]
-        train_terminal = [d[4] for d in sample_data]
-        return train_s, train_a, train_r, train_s_, train_terminal
+RENDER_FPS = None  # 画面帧率上限，None 为不限速
+SHOW_EVERY = 100  # 每隔多少帧在窗口显示一次，0 为只在后台渲染
+SAVE_EVERY = 10000  # 每隔多少步保存一次
 
 
 class DeepQN(object):
     """
     定义值函数网络，完成神经网络的创建和训练
     """
-    def __init__(self, lr=1.0e-6, model_file=None) -> None:
+    def __init__(self, lr=1.0e-6, model_file=None, config=None) -> None:
         self.gamma = GAMMA
         self.tau = 0.01
 
-        # tf 工程
-        self.sess = tf.Session()
+        # tf 工程，config 为会话的 tf.ConfigProto
+        self.sess = tf.Session(config=config)
         self.learning_rate = lr
         # 1. 输入层
         self.obs = tf.placeholder(tf.float32, shape=[None, 80, 80, 4])
@@ -72,15 +49,26 @@ class DeepQN(object):
         self.qe_params = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='eval')
         self.qt_params = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='target')
         # 2.4 定义新旧参数的替换操作
-        self.update_oldq_op = [oldq.assign((1 - self.tau) * oldq + self.tau * p)
-            for p, oldq in zip(self.qe_params, self.qt_params)]
+        self.update_oldq_op = self.soft_update()
         # 3. 构建损失函数
-        # TD target
-        self.q_target = tf.placeholder(tf.float32, [None])
+        # TD target 在图中计算，终止状态只有回报
+        self.reward = tf.placeholder(tf.float32, [None])
+        self.terminal = tf.placeholder(tf.float32, [None])
+        self.q_target = tf.stop_gradient(
+            self.reward + self.gamma * (1. - self.terminal) * tf.reduce_max(self.Q_, axis=1))
+        self.q_max = tf.reduce_max(self.q_target)
+        # 优先经验回放的重要性采样权重，默认全为 1
+        self.is_weights = tf.placeholder_with_default(tf.ones_like(self.reward), [None])
         readout_q = tf.reduce_sum(tf.multiply(self.Q, self.action), reduction_indices=1)
-        self.q_loss = tf.losses.mean_squared_error(labels=self.q_target, predictions=readout_q)
+        # TD 误差，用于更新样本的优先级
+        self.td_error = self.q_target - readout_q
+        self.q_loss = tf.losses.mean_squared_error(
+            labels=self.q_target, predictions=readout_q, weights=self.is_weights)
         # 4. 定义优化器
         self.q_train_op = tf.train.AdamOptimizer(lr).minimize(self.q_loss, var_list=self.qe_params)
+        # 训练一步后再更新目标网络，一次 sess.run 完成
+        with tf.control_dependencies([self.q_train_op]):
+            self.train_op = tf.group(*self.soft_update())
         # 5. 初始化图中的变量
         self.sess.run(tf.global_variables_initializer())
         # 6. 定义保存和恢复模型
@@ -88,6 +76,19 @@ class DeepQN(object):
         if model_file is not None:
             self.restore_model(model_file)
 
+    def soft_update(self):
+        # 在调用处的控制依赖中重新读取参数
+        return [oldq.assign((1 - self.tau) * oldq.read_value() + self.tau * p.read_value())
+            for p, oldq in zip(self.qe_params, self.qt_params)]
+
+    # 读取和载入值函数网络的参数，用于在进程间同步网络
+    def get_weights(self):
+        return self.sess.run(self.qe_params)
+
+    def set_weights(self, weights):
+        for param, value in zip(self.qe_params, weights):
+            param.load(value, self.sess)
+
     # 定义存储模型函数
     def save_model(self, model_path, global_step):
         self.saver.save(self.sess, model_path, global_step=global_step)
@@ -128,80 +129,115 @@ class DeepQN(object):
                 trainable=trainable)
             return qout
 
-    def epsilon_greedy(self, s_t, epsilon):
-        a_t = np.zeros([ACTIONS])
-        amax = np.argmax(self.sess.run(self.Q, {self.obs: [s_t]})[0])
+    def act_batch(self, states, epsilon):
+        """
+        为 N 个环境的状态 (N, 80, 80, 4) 按 ε-贪心选择动作，返回 N 个动作下标。
+        epsilon 可以是标量或每个环境一个值；只对不探索的环境做一次前向计算，
+        全部探索时不运行网络。
+        """
+        n = len(states)
         # 概率部分
-        if np.random.uniform() < 1 - epsilon:
+        explore = np.random.uniform(size=n) >= 1 - np.asarray(epsilon)
+        actions = np.random.randint(ACTIONS, size=n)
+        greedy = ~explore
+        if greedy.any():
             # 最优动作
-            a_t[amax] = 1
-        else:
-            a_t[random.randrange(ACTIONS)] = 1
+            q = self.sess.run(self.Q, {self.obs: np.asarray(states)[greedy]})
+            actions[greedy] = np.argmax(q, axis=1)
+        return actions
+
+    def epsilon_greedy(self, s_t, epsilon):
+        a_t = np.zeros([ACTIONS])
+        a_t[self.act_batch(s_t[None], epsilon)[0]] = 1
         return a_t
 
-    def train_network(self, experience_buffer):
+    def train_batch(self, batch, weights=None):
+        """
+        用一批样本 (s, a, r, s_, terminal) 训练一次并更新目标网络，
+        weights 为重要性采样权重。返回目标 Q 的最大值和每个样本的 TD 误差
+        """
+        train_s, train_a, train_r, train_s_, train_terminal = batch
+        feed_dict = {self.obs: train_s, self.action: train_a, self.obs_: train_s_,
+                     self.reward: train_r, self.terminal: train_terminal}
+        if weights is not None:
+            feed_dict[self.is_weights] = weights
+        _, q_max, td_error = self.sess.run([self.train_op, self.q_max, self.td_error], feed_dict=feed_dict)
+        return q_max, td_error
+
+    def train_network(self, experience_buffer, checkpointer=None):
+        # 后台保存模型，并从最近的检查点恢复网络、经验池和 epsilon
+        if checkpointer is None:
+            checkpointer = AsyncCheckpointer(prefix='dqn')
+        epsilon = INITIAL_EPSILON
+        t = 0
+        checkpoint = checkpointer.restore(self.sess, experience_buffer)
+        if checkpoint is not None:
+            epsilon = checkpoint['state']['epsilon']
+            t = checkpoint['step']
+            logger.info(f"Resumed from {checkpoint['file']}")
+
         # 打开游戏状态与模拟器进行通信
-        game_state = Game()
+        game_state = Game(fps=RENDER_FPS, show_every=SHOW_EVERY, obs_mode='gray')
+        # 预处理器和帧栈，缓冲区只分配一次
+        preprocess = FramePreprocessor()
+        frames = FrameStack()
         # 获得第一个状态并将图像进行预处理
         do_nothing = np.zeros(ACTIONS)
         do_nothing[0] = 1
 
         # 与游戏交互一次
         x_t, r_0, terminal = game_state.frame_step(do_nothing)
-        x_t = cv2.cvtColor(cv2.resize(x_t, (80, 80)), cv2.COLOR_BGR2GRAY)
-        ret, x_t = cv2.threshold(x_t, 1, 255, cv2.THRESH_BINARY)
-        s_t = np.stack((x_t, x_t, x_t, x_t), axis=2)
+        x_t = preprocess(x_t)
+        s_t = frames.reset(x_t)
+        # 经验池只存每一帧，状态由帧的下标重建
+        experience_buffer.start(x_t)
+
+        # 优先经验回放的采样还会返回权重和样本位置
+        prioritized = isinstance(experience_buffer, PrioritizedReplayMemory)
+
+        # 每局得分，保存时用最近几局的平均分评价模型
+        episode_score = 0
+        scores = []
 
         # 开始训练
-        epsilon = INITIAL_EPSILON
-        t = 0
         while "flappy bird" != "angry bird":
             a_t = self.epsilon_greedy(s_t, epsilon=epsilon)
             # epsilon递减
             if epsilon > FINAL_EPSILON and t > OBSERVE:
                 epsilon -= (INITIAL_EPSILON-FINAL_EPSILON)/EXPLORE
             # 运动动作，与游戏环境交互一次
-            x_t1_colored, r_t, terminal = game_state.frame_step(a_t)
-            x_t1 = cv2.cvtColor(cv2.resize(
-                x_t1_colored, (80, 80)), cv2.COLOR_BGR2GRAY)
-            ret, x_t1 = cv2.threshold(x_t1, 1, 255, cv2.THRESH_BINARY)
-            x_t1 = np.reshape(x_t1, (80, 80, 1))
-            s_t1 = np.append(x_t1, s_t[:, :, :3], axis=2)
+            x_t1, r_t, terminal = game_state.frame_step(a_t)
+            x_t1 = preprocess(x_t1)
+            s_t1 = frames.push(x_t1)
 
             # 将数据存储到经验池中
-            experience = np.reshape(
-                np.array([s_t, a_t, r_t, s_t1, terminal]), [1, 5])
-            # print("experience", r_t, terminal)
-            experience_buffer.add_experience(experience)
+            experience_buffer.add(x_t1, np.argmax(a_t), r_t, terminal)
+            episode_score += r_t == 1
+            if terminal:
+                scores.append(episode_score)
+                episode_score = 0
 
-            target_q = [0]
+            q_max = 0
             # 在观察结束后进行训练
             if t > OBSERVE:
-                # 采集样本
-                train_s, train_a, train_r, train_s_, train_terminal = \
-                    experience_buffer.sample(BATCH)
-                target_q = []
-                read_target_Q = self.sess.run(self.Q_, {self.obs_: train_s_})
-                for i in range(len(train_r)):
-                    if train_terminal[i]:
-                        target_q.append(train_r[i])
-                    else:
-                        target_q.append(train_r[i]+GAMMA*np.max(read_target_Q[i]))
-                # print(target_q)
-
-                # 训练一次
-                self.sess.run(self.q_train_op, feed_dict={
-                              self.obs: train_s, self.action: train_a, self.q_target: target_q})
-                # 更新旧的目标网络
-                # if t%1000 == 0:
-                self.sess.run(self.update_oldq_op)
+                # 采集样本，训练一次并更新旧的目标网络
+                if prioritized:
+                    # 按重要性采样权重训练，并用 TD 误差更新优先级
+                    *batch, weights, slots = experience_buffer.sample(BATCH)
+                    q_max, td_error = self.train_batch(batch, weights)
+                    experience_buffer.update_priorities(slots, td_error)
+                else:
+                    q_max, _ = self.train_batch(experience_buffer.sample(BATCH))
 
             # 往前推进一步
             s_t = s_t1
             t += 1
-            # 每10000次迭代保存一次
-            if t % 10000 == 0:
-                self.save_model('models/', global_step=t)
+            # 每10000次迭代保存一次，写文件在后台进行
+            if t % SAVE_EVERY == 0:
+                checkpointer.save(t, snapshot_variables(self.sess), {'epsilon': epsilon},
+                                  score=float(np.mean(scores)) if scores else None,
+                                  replay=experience_buffer)
+                scores = []
 
             # if t <= OBSERVE:
             #     print("OBSERVE", t)
@@ -221,10 +257,15 @@ class DeepQN(object):
 
             print("TRAIN STEP", t, "/ STATE", state,
                 "/ EPSILON %.6f" % epsilon, "/ ACTION", a_t, "/ REWARD", r_t,
-                "/ TERMINAL", terminal, "/ Q_MAX %e" % max(target_q))
+                "/ TERMINAL", terminal, "/ Q_MAX %e" % q_max)
 
 
 if __name__ == "__main__":
-    buffer = ExperienceBuffer()
+    if PRIORITIZED:
+        buffer = PrioritizedReplayMemory(REPLAY_MEMORY)
+    elif REPLAY_DIR:
+        buffer = MemmapReplayMemory(REPLAY_DIR, REPLAY_MEMORY)
+    else:
+        buffer = ReplayMemory(REPLAY_MEMORY)
     brain = DeepQN()
     brain.train_network(buffer)
\ No newline at end of file
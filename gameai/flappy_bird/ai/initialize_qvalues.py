@@ -1,7 +1,9 @@
 import json
 from itertools import chain
 
-# Script to create Q-Value JSON file, initilazing with zeros
+from gameai.flappy_bird.ai.qtable import QTable, QVALUES_PATH, QVALUES_JSON
+
+# Script to create Q-Value JSON and binary files, initilazing with zeros
 
 qval = {}
 # X -> [-40,-30...120] U [140, 210 ... 490]
@@ -12,6 +14,7 @@ for x in chain(list(range(-40, 140, 10)), list(range(140, 421, 70))):
             qval[str(x) + "_" + str(y) + "_" + str(v)] = [0, 0]
 
 
-fd = open("data/qvalues.json", "w")
+fd = open(QVALUES_JSON, "w")
 json.dump(qval, fd)
 fd.close()
+QTable.from_dict(qval).save(QVALUES_PATH)
@@ -0,0 +1,125 @@
+"""
+Lookahead agent: plays by searching the future of the game.
+
+Every frame the state of the game is copied into a headless simulation,
+see Game.snapshot, and the agent searches it depth-first for a way to
+survive the next HORIZON decisions of HOLD frames each: the action on the
+first frame, nothing on the others. Not flapping is tried first, branches
+that crash are cut. The simulation draws the same pipes as the game, or
+plays its pipe course, so the agent knows the pipes that are not spawned
+yet. The rest of the last
+plan found is followed when a search fails.
+
+    python -m gameai.flappy_bird.ai.lookahead --games 10 --seed 0
+"""
+import time
+import argparse
+from collections import deque
+import numpy as np
+from loguru import logger
+
+from gameai.flappy_bird.game.core import FPS
+from gameai.flappy_bird.game.run import Game
+
+HORIZON = 12 # decisions searched ahead
+HOLD = 4     # frames of a searched decision
+
+NOOP = (1, 0)
+FLAP = (0, 1)
+
+
+class LookaheadAgent(object):
+    """
+    Depth-first search over the actions of a copy of the game.
+
+    The actions of the last plan found are kept frame by frame: the
+    simulation is exact, so the rest of a plan still survives. When no plan
+    is found, e.g. because a flap of the last one falls between two
+    searched decisions, the agent goes on with it.
+    `nodes` counts the decisions simulated, over all calls of act.
+    """
+    def __init__(self, horizon=HORIZON, hold=HOLD) -> None:
+        self.horizon = horizon
+        self.hold = hold
+        self.sim = Game(daemon=True, verbose=False)
+        self.plan = deque()
+        self.nodes = 0
+
+    def act(self, game):
+        """the next action, 1 to flap, of a plan that survives the horizon of `game`"""
+        root = game.snapshot()
+        path = []
+        for action in (0, 1):
+            self.sim.restore(root)
+            if self._survives(action, self.horizon, path):
+                self.plan.clear()
+                for decision in reversed(path):
+                    self.plan.append(decision)
+                    self.plan.extend([0] * (self.hold - 1))
+                break
+        return self.plan.popleft() if self.plan else 0
+
+    def _advance(self, action):
+        """plays a decision on the simulation, returns True when the bird crashed"""
+        self.nodes += 1
+        frame_step = self.sim.frame_step
+        if frame_step(FLAP if action else NOOP)[2]:
+            return True
+        for _ in range(self.hold - 1):
+            if frame_step(NOOP)[2]:
+                return True
+        return False
+
+    def _survives(self, action, depth, path):
+        """True when there is a way to survive `depth` decisions starting with `action`, appended to path backwards"""
+        if self._advance(action):
+            return False
+        if depth > 1:
+            snapshot = self.sim.snapshot()
+            if not self._survives(0, depth - 1, path):
+                self.sim.restore(snapshot)
+                if not self._survives(1, depth - 1, path):
+                    return False
+        path.append(action)
+        return True
+
+
+def play(games=10, seed=None, daemon=True, fps=FPS, horizon=HORIZON, hold=HOLD, max_score=1000):
+    """
+    plays `games` games with a LookaheadAgent, returns their scores. a game
+    is stopped at max_score.
+    """
+    game = Game(daemon=daemon, fps=fps, seed=seed, verbose=False)
+    agent = LookaheadAgent(horizon, hold)
+    scores = []
+    frames = 0
+    start = time.time()
+    while len(scores) < games:
+        score = game.score
+        action = agent.act(game)
+        _, _, terminal = game.frame_step(FLAP if action else NOOP)
+        frames += 1
+        if terminal or game.score >= max_score:
+            scores.append(game.score if not terminal else score)
+            logger.debug(f'Game {len(scores)} | score: {scores[-1]}')
+            if not terminal:
+                game.reset()
+    elapsed = time.time() - start
+    logger.info(f'{frames} frames, {elapsed / frames * 1000:.2f} ms and '
+                f'{agent.nodes / frames:.1f} searched decisions per frame')
+    return scores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Lookahead search agent")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--horizon", type=int, default=HORIZON, help="decisions searched ahead")
+    parser.add_argument("--hold", type=int, default=HOLD, help="frames of a searched decision")
+    parser.add_argument("--max-score", type=int, default=1000, help="score a game is stopped at")
+    parser.add_argument("--render", action="store_true", help="show the games")
+    args = parser.parse_args()
+
+    scores = play(args.games, args.seed, daemon=not args.render, horizon=args.horizon, hold=args.hold,
+                  max_score=args.max_score)
+    logger.info(f'scores: {scores}, mean {np.mean(scores):.1f}')
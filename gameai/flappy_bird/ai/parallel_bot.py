@@ -0,0 +1,107 @@
+"""
+Tabular Q-learning with several headless Game + Bot workers.
+
+Every worker plays its share of the --iter games with its own seed. Every
+--sync-every games the workers stop at a barrier, worker 0 merges their
+tables into the shared table with qtable.merge_tables and every worker
+continues from the merged table. The tables live in shared memory, no
+table is pickled between processes.
+
+    python -m gameai.flappy_bird.ai.parallel_bot --iter 10000 --workers 8
+"""
+import os
+import argparse
+import multiprocessing as mp
+import numpy as np
+from loguru import logger
+
+from gameai.flappy_bird.ai.qtable import QTable, STATES, ACTIONS, QVALUES_PATH, merge_tables
+
+SYNC_EVERY = 50  # games each worker plays between two merges
+
+
+def _shared(array, shape):
+    return np.frombuffer(array, dtype=np.float64).reshape(shape)
+
+
+def worker(i, games, rounds, sync_every, seed, shared_q, worker_q, worker_visits, barrier):
+    from gameai.flappy_bird.game import run
+    from gameai.flappy_bird.game.run import Game
+    from gameai.flappy_bird.ai.bot import Bot, bot_step
+
+    # one log line per death and worker is too much
+    run.VERBOSE = False
+    num_workers = barrier.parties
+    table = _shared(shared_q, (STATES, ACTIONS))
+    tables = _shared(worker_q, (num_workers, STATES, ACTIONS))
+    visits = _shared(worker_visits, (num_workers, STATES, ACTIONS))
+
+    game = Game(daemon=True, seed=seed)
+    bot = Bot(qtable=QTable(table.copy()))
+    played = 0
+    try:
+        for r in range(rounds):
+            target = min(games, played + sync_every)
+            while played < target:
+                if bot_step(game, bot):
+                    bot.update_scores(dump_qvalues=False)
+                    played += 1
+
+            tables[i] = bot.qvalues
+            visits[i] = bot.visits
+            barrier.wait()
+            if i == 0:
+                table[:] = merge_tables(table, tables, visits)
+                logger.info(f'Merged round {r + 1}/{rounds}, {int(visits.sum())} updates')
+            barrier.wait()
+            bot.qvalues[:] = table
+            bot.visits[:] = 0
+    except Exception:
+        # release the workers waiting for this one
+        barrier.abort()
+        raise
+
+
+def train(iterations, num_workers=None, sync_every=SYNC_EVERY, seed=0, path=QVALUES_PATH):
+    """trains the table at `path` on `iterations` games split over the workers"""
+    from gameai.flappy_bird.ai.bot import load_qtable
+
+    num_workers = num_workers or os.cpu_count()
+    games = [iterations // num_workers + (i < iterations % num_workers) for i in range(num_workers)]
+    # every worker waits at every merge, so all of them do the same number of rounds
+    rounds = max(1, -(-max(games) // sync_every))
+
+    shared_q = mp.RawArray('d', STATES * ACTIONS)
+    worker_q = mp.RawArray('d', num_workers * STATES * ACTIONS)
+    worker_visits = mp.RawArray('d', num_workers * STATES * ACTIONS)
+    table = _shared(shared_q, (STATES, ACTIONS))
+    table[:] = load_qtable().values
+    barrier = mp.Barrier(num_workers)
+
+    workers = [
+        mp.Process(target=worker, args=(i, games[i], rounds, sync_every, seed + i,
+                                        shared_q, worker_q, worker_visits, barrier))
+        for i in range(num_workers)
+    ]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    if any(p.exitcode != 0 for p in workers):
+        raise RuntimeError('A worker failed, the table was not saved')
+
+    QTable(table.copy()).save(path)
+    logger.info(f'Q-values of {iterations} games saved to {path}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("parallel_bot.py")
+    parser.add_argument("--iter", type=int, default=1000,
+                        help="number of games to play over all workers")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes, one per core by default")
+    parser.add_argument("--sync-every", type=int, default=SYNC_EVERY,
+                        help="games each worker plays between two merges")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    train(args.iter, args.workers, args.sync_every, args.seed)
@@ -0,0 +1,140 @@
+"""
+The DeepQN eval network as plain NumPy, for playing without tensorflow.
+
+`export` copies the weights of the eval network out of a checkpoint into a
+small npz, `Policy` loads it and runs the forward pass with NumPy only.
+
+    python -m gameai.flappy_bird.ai.policy export --best
+    python -m gameai.flappy_bird.ai.policy play
+"""
+import os
+import argparse
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from gameai.flappy_bird.game.core import FPS
+
+POLICY_PATH = 'saved_networks/dqn-policy.npz'
+# layers of DeepQN.build_q_net, as tf.layers names them: (name, stride)
+CONVS = (('conv2d', 4), ('conv2d_1', 2), ('conv2d_2', 2))
+DENSES = ('dense', 'dense_1')
+
+
+def export(values, path=POLICY_PATH, scope='eval'):
+    """writes the kernels and biases of network `scope` from {variable name: array}, e.g. a checkpoint"""
+    weights = {}
+    for layer in [name for name, _ in CONVS] + list(DENSES):
+        for kind in ('kernel', 'bias'):
+            weights[f'{layer}/{kind}'] = np.asarray(values[f'{scope}/{layer}/{kind}:0'], dtype=np.float32)
+    np.savez(path, **weights)
+
+
+def _pad_same(x, kernel, stride, value=0.):
+    """pads the H and W axes of NHWC `x` like tensorflow's 'SAME' padding"""
+    pads = [(0, 0)]
+    for size in x.shape[1:3]:
+        out = -(-size // stride)
+        total = max((out - 1) * stride + kernel - size, 0)
+        pads.append((total // 2, total - total // 2))
+    pads.append((0, 0))
+    return np.pad(x, pads, constant_values=value)
+
+
+class Policy(object):
+    """
+    Q network forward pass: three 'SAME' convolutions with relu, a 2x2 max
+    pool after the first, a 512 unit relu layer and the Q value readout.
+    Convolutions are matrix products over the windows of their input.
+    """
+    def __init__(self, path=POLICY_PATH) -> None:
+        with np.load(path) as weights:
+            self.convs = []
+            for name, stride in CONVS:
+                kernel = weights[f'{name}/kernel']
+                k, _, channels, filters = kernel.shape
+                # (k, k, C, F) to the (C, k, k) window order of sliding_window_view
+                matrix = kernel.transpose(2, 0, 1, 3).reshape(channels * k * k, filters)
+                self.convs.append((matrix, weights[f'{name}/bias'], k, stride))
+            self.denses = [(weights[f'{name}/kernel'], weights[f'{name}/bias']) for name in DENSES]
+
+    @staticmethod
+    def _conv(x, matrix, bias, k, stride):
+        x = _pad_same(x, k, stride)
+        windows = sliding_window_view(x, (k, k), axis=(1, 2))[:, ::stride, ::stride]
+        n, h, w = windows.shape[:3]
+        out = windows.reshape(n * h * w, -1) @ matrix
+        out += bias
+        np.maximum(out, 0, out=out)
+        return out.reshape(n, h, w, -1)
+
+    @staticmethod
+    def _max_pool(x):
+        x = _pad_same(x, 2, 2, value=-np.inf)
+        n, h, w, c = x.shape
+        return x.reshape(n, h // 2, 2, w // 2, 2, c).max(axis=(2, 4))
+
+    def q_values(self, states):
+        """(N, 2) Q values of the (N, 80, 80, 4) states"""
+        x = np.asarray(states, dtype=np.float32)
+        for i, conv in enumerate(self.convs):
+            x = self._conv(x, *conv)
+            if i == 0:
+                x = self._max_pool(x)
+        x = x.reshape(len(x), -1)
+        (w1, b1), (w2, b2) = self.denses
+        x = np.maximum(x @ w1 + b1, 0)
+        return x @ w2 + b2
+
+    def act_batch(self, states):
+        """greedy action index for each state"""
+        return np.argmax(self.q_values(states), axis=1)
+
+    def act(self, s_t):
+        return int(self.act_batch(s_t[None])[0])
+
+
+def play(path=POLICY_PATH, fps=FPS):
+    """plays with the exported network forever"""
+    from gameai.flappy_bird.game.run import Game
+    from gameai.flappy_bird.ai.preprocess import FramePreprocessor, FrameStack
+
+    policy = Policy(path)
+    game_state = Game(fps=fps, obs_mode='gray')
+    preprocess = FramePreprocessor()
+    frames = FrameStack()
+
+    a_t = np.zeros(2)
+    a_t[0] = 1
+    x_t, _, _ = game_state.frame_step(a_t)
+    s_t = frames.reset(preprocess(x_t))
+    while True:
+        a_t[:] = 0
+        a_t[policy.act(s_t)] = 1
+        x_t, _, _ = game_state.frame_step(a_t)
+        s_t = frames.push(preprocess(x_t))
+
+
+if __name__ == "__main__":
+    from gameai.flappy_bird.ai.checkpoint import latest_checkpoint, SAVE_DIR
+
+    parser = argparse.ArgumentParser("NumPy DQN policy")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write the eval network of a DeepQN checkpoint")
+    export_parser.add_argument("--dir", default=SAVE_DIR, help="checkpoint directory")
+    export_parser.add_argument("--prefix", default="dqn", help="checkpoint prefix, dqn or apex")
+    export_parser.add_argument("--best", action="store_true", help="export the best scoring checkpoint, not the latest")
+    export_parser.add_argument("--out", default=POLICY_PATH)
+    play_parser = commands.add_parser("play", help="play with an exported network")
+    play_parser.add_argument("--policy", default=POLICY_PATH)
+    play_parser.add_argument("--fps", type=int, default=FPS, help="0 for full speed")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        checkpoint = latest_checkpoint(args.dir, args.prefix, args.best)
+        if checkpoint is None:
+            parser.error(f"no {args.prefix} checkpoint in {args.dir}")
+        with np.load(os.path.join(args.dir, checkpoint['file'])) as values:
+            export(values, args.out)
+        print("Exported", checkpoint['file'], "to", args.out)
+    else:
+        play(args.policy, args.fps or None)
@@ -0,0 +1,90 @@
+import cv2
+import numpy as np
+
+
+class FramePreprocessor(object):
+    """
+    Turns game frames into the binary 80x80 images the DQN agents stack.
+
+    Accepts the RGB frames of `Game(obs_mode='rgb' or 'buffer')`, which are
+    resized and converted to grayscale first, or the grayscale frames of
+    `Game(obs_mode='gray')`, which only need the threshold. Every output is
+    written to a buffer allocated once, so the returned array is overwritten
+    by the next call.
+    """
+    def __init__(self, size=(80, 80)) -> None:
+        self.size = tuple(size)
+        self._small = np.zeros(self.size + (3,), dtype=np.uint8)
+        self._gray = np.zeros(self.size, dtype=np.uint8)
+        self._mask = np.zeros(self.size, dtype=bool)
+        self.out = np.zeros(self.size, dtype=np.uint8)
+        # batch buffers, reallocated only when the batch size changes
+        self._batch_gray = None
+        self._batch_mask = None
+        self.batch_out = None
+
+    def _to_gray(self, frame, small, gray):
+        if frame.ndim == 2:
+            return frame
+        cv2.resize(frame, self.size, dst=small)
+        cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=gray)
+        return gray
+
+    def __call__(self, frame):
+        """returns the (80, 80) uint8 image, 255 where the frame is not black"""
+        gray = self._to_gray(frame, self._small, self._gray)
+        np.greater(gray, 1, out=self._mask)
+        np.multiply(self._mask, 255, out=self.out, casting='unsafe')
+        return self.out
+
+    def batch(self, frames):
+        """__call__ for the (N, ...) frames of N environments, returns (N, 80, 80)"""
+        n = len(frames)
+        if self.batch_out is None or len(self.batch_out) != n:
+            self._batch_gray = np.zeros((n,) + self.size, dtype=np.uint8)
+            self._batch_mask = np.zeros((n,) + self.size, dtype=bool)
+            self.batch_out = np.zeros((n,) + self.size, dtype=np.uint8)
+
+        gray = frames
+        if np.ndim(frames) == 4:
+            for i in range(n):
+                self._to_gray(frames[i], self._small, self._batch_gray[i])
+            gray = self._batch_gray
+        np.greater(gray, 1, out=self._batch_mask)
+        np.multiply(self._batch_mask, 255, out=self.batch_out, casting='unsafe')
+        return self.batch_out
+
+
+class FrameStack(object):
+    """
+    The last `history` frames stacked along the last axis, newest first.
+
+    Pushing a frame does not shift the stack: every frame is written twice,
+    at `pos` and `pos + history` of a buffer holding 2 * history frames, so
+    the stack is always the view `buffer[..., pos:pos + history]`. The view
+    changes with the next push, copy it to keep a state.
+
+    `shape` is the shape of one frame, or (N, 80, 80) to stack the frames of
+    N environments stepped together.
+    """
+    def __init__(self, shape=(80, 80), history=4, dtype=np.uint8) -> None:
+        self.history = history
+        self.buffer = np.zeros(tuple(shape) + (2 * history,), dtype=dtype)
+        self.pos = 0
+
+    @property
+    def state(self):
+        return self.buffer[..., self.pos:self.pos + self.history]
+
+    def reset(self, frame):
+        """fills the whole stack with `frame`"""
+        self.buffer[...] = frame[..., None]
+        self.pos = 0
+        return self.state
+
+    def push(self, frame):
+        """adds the newest frame, dropping the oldest"""
+        self.pos = (self.pos - 1) % self.history
+        self.buffer[..., self.pos] = frame
+        self.buffer[..., self.pos + self.history] = frame
+        return self.state
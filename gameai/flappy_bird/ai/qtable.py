@@ -0,0 +1,307 @@
+"""
+Dense Q-table of the tabular bot.
+
+States are the (xdif, ydif, vel) buckets of Bot.map_state, numbered
+arithmetically so that a state is an int index into one NumPy array:
+
+    X -> [-40, -30 ... 130] U [140, 210 ... 420]
+    Y -> [-300, -290 ... 170] U [180, 240 ... 420]
+    V -> [-10, -9 ... 10]
+
+Tables are saved in a binary file: MAGIC, the length of a JSON header
+describing the grid as a little endian uint32, the header, then the raw
+(STATES, 2) float64 values, which are memory-mapped when loading. Changes
+in between two full saves can be appended to the `<file>.log` delta log:
+the id of the full save it follows, then records of an int32 count,
+count int32 state indices and their (count, 2) float64 rows. A log left
+behind by an older save has another id and is ignored, and a record torn
+by a crash is cut before the next one is appended.
+
+A trained table can be frozen into its greedy policy, one uint8 action per
+state, saved bit-packed next to the table in data/policy.npz.
+"""
+import os
+import json
+from itertools import chain
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+X_BUCKETS = tuple(chain(range(-40, 140, 10), range(140, 421, 70)))
+Y_BUCKETS = tuple(chain(range(-300, 180, 10), range(180, 421, 60)))
+V_BUCKETS = tuple(range(-10, 11))
+SHAPE = (len(X_BUCKETS), len(Y_BUCKETS), len(V_BUCKETS))
+STATES = SHAPE[0] * SHAPE[1] * SHAPE[2]
+ACTIONS = 2
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+QVALUES_PATH = os.path.join(DATA_DIR, 'qvalues.bin')
+QVALUES_JSON = os.path.join(DATA_DIR, 'qvalues.json')
+POLICY_PATH = os.path.join(DATA_DIR, 'policy.npz')
+MAGIC = b'FBQTAB01'
+DTYPE = np.dtype('<f8')
+
+
+def _grid_header():
+    return {'x': list(X_BUCKETS), 'y': list(Y_BUCKETS), 'v': list(V_BUCKETS),
+            'actions': ACTIONS, 'dtype': DTYPE.str}
+
+
+def state_index(xdif, ydif, vel):
+    """
+    returns the index of the bucket of (xdif, ydif, vel), the buckets are
+    10 wide below x 140 and y 180 and 70 and 60 wide above.
+    raises KeyError outside of the grid.
+    """
+    x, y = int(xdif), int(ydif)
+    ix = x // 10 + 4 if xdif < 140 else x // 70 + 16
+    iy = y // 10 + 30 if ydif < 180 else y // 60 + 45
+    iv = vel + 10
+    if not (0 <= ix < SHAPE[0] and 0 <= iy < SHAPE[1] and 0 <= iv < SHAPE[2]):
+        raise KeyError(f'{xdif}_{ydif}_{vel}')
+    return (ix * SHAPE[1] + iy) * SHAPE[2] + iv
+
+
+def state_indices(xdif, ydif, vel):
+    """state_index of arrays of states"""
+    xdif, ydif, vel = np.asarray(xdif), np.asarray(ydif), np.asarray(vel)
+    x, y = np.trunc(xdif).astype(np.int64), np.trunc(ydif).astype(np.int64)
+    ix = np.where(xdif < 140, x // 10 + 4, x // 70 + 16)
+    iy = np.where(ydif < 180, y // 10 + 30, y // 60 + 45)
+    iv = vel.astype(np.int64) + 10
+    inside = (0 <= ix) & (ix < SHAPE[0]) & (0 <= iy) & (iy < SHAPE[1]) & (0 <= iv) & (iv < SHAPE[2])
+    if not inside.all():
+        i = np.flatnonzero(~inside.ravel())[0]
+        raise KeyError(f'{xdif.ravel()[i]}_{ydif.ravel()[i]}_{vel.ravel()[i]}')
+    return (ix * SHAPE[1] + iy) * SHAPE[2] + iv
+
+
+def state_buckets(index):
+    """the (x, y, v) bucket values of a state index, the inverse of state_index"""
+    ix, iy, iv = np.unravel_index(index, SHAPE)
+    return X_BUCKETS[ix], Y_BUCKETS[iy], V_BUCKETS[iv]
+
+
+def state_key(index):
+    """the "x_y_v" key of a state in data/qvalues.json"""
+    return '_'.join(str(b) for b in state_buckets(index))
+
+
+def _sweep(rows, states, actions, next_states, rewards, lr, discount):
+    # newest transition first, each update sees the ones after it in the episode
+    keep = 1 - lr
+    for state, act, res, reward in zip(reversed(states), reversed(actions), reversed(next_states), reversed(rewards)):
+        row = rows[state]
+        q0, q1 = rows[res]
+        row[act] = keep * row[act] + lr * (reward + discount * (q0 if q0 >= q1 else q1))
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _sweep_kernel(values, states, actions, next_states, rewards, lr, discount):
+        for i in range(len(states) - 1, -1, -1):
+            s, a, res = states[i], actions[i], next_states[i]
+            values[s, a] = (1 - lr) * values[s, a] + lr * (rewards[i] + discount * max(values[res, 0], values[res, 1]))
+
+
+def backward_sweep(values, states, actions, next_states, rewards, lr, discount):
+    """
+    applies the Q-learning update of an episode's transitions to `values`,
+    from the last transition to the first, in place.
+
+    runs the compiled kernel when numba is installed. without it, the rows
+    the episode touches are copied to Python lists and updated there, which
+    gives the same float64 results as the update on the whole table.
+    """
+    if njit is not None:
+        _sweep_kernel(np.asarray(values), states, actions, next_states, rewards, float(lr), float(discount))
+        return
+    touched, local = np.unique(np.concatenate((states, next_states)), return_inverse=True)
+    rows = values[touched].tolist()
+    _sweep(rows, local[:len(states)].tolist(), actions.tolist(), local[len(states):].tolist(),
+           rewards.tolist(), lr, discount)
+    values[touched] = rows
+
+
+def merge_tables(base, tables, visits):
+    """
+    visit-count weighted average of (M, STATES, 2) `tables` learned from
+    `base`, each entry weighted by the number of updates it got in that
+    table. entries no table updated keep their base value.
+    """
+    total = visits.sum(axis=0)
+    weighted = (tables * visits).sum(axis=0)
+    return np.where(total > 0, weighted / np.maximum(total, 1), base)
+
+
+def save_policy(policy, path=POLICY_PATH):
+    """writes a (STATES,) action table bit-packed, with the state grid it was frozen on"""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, actions=np.packbits(np.asarray(policy, dtype=bool)), grid=json.dumps(_grid_header()))
+    os.replace(tmp, path)
+
+
+def load_policy(path=POLICY_PATH):
+    """the (STATES,) uint8 action table of save_policy"""
+    with np.load(path) as f:
+        if json.loads(str(f['grid'])) != _grid_header():
+            raise ValueError(f'{path} was saved for another state grid')
+        return np.unpackbits(f['actions'], count=STATES)
+
+
+class QTable(object):
+    """
+    Q values of every (state, action) in a (STATES, 2) float array, rows
+    indexed by state_index. `grid` is the same array as (23, 53, 21, 2).
+    """
+    def __init__(self, values=None) -> None:
+        if values is None:
+            values = np.zeros((STATES, ACTIONS), dtype=np.float64)
+        if values.shape != (STATES, ACTIONS):
+            raise ValueError(f'Expected Q values of shape {(STATES, ACTIONS)}, got {values.shape}')
+        self.values = values
+        # id of the binary file the values were last loaded from or saved to
+        self.id = None
+
+    @property
+    def grid(self):
+        return self.values.reshape(SHAPE + (ACTIONS,))
+
+    @classmethod
+    def from_dict(cls, qvalues):
+        """from the {"x_y_v": [q0, q1]} dict of the JSON format"""
+        table = cls()
+        for key, q in qvalues.items():
+            x, y, v = (int(b) for b in key.split('_'))
+            table.values[state_index(x, y, v)] = q
+        return table
+
+    def greedy_policy(self):
+        """
+        (STATES,) uint8 table of the greedy action of every state, 0 (don't
+        flap) on ties as Bot.act does
+        """
+        return (self.values[:, 1] > self.values[:, 0]).astype(np.uint8)
+
+    def to_dict(self):
+        return {state_key(i): self.values[i].tolist() for i in range(STATES)}
+
+    @classmethod
+    def load_json(cls, path):
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+    def dump_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path=QVALUES_PATH, mode='c'):
+        """
+        maps the values of a binary file and applies its delta log. with the
+        default mode 'c' changes stay in memory until saved. a torn or
+        stale log is cut, except in the read-only mode 'r'.
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a Q-table file')
+            size = int.from_bytes(f.read(4), 'little')
+            header = json.loads(f.read(size))
+        file_id = header.pop('id')
+        if header != _grid_header():
+            raise ValueError(f'{path} was saved for another state grid')
+        values = np.memmap(path, dtype=DTYPE, mode=mode, offset=len(MAGIC) + 4 + size,
+                           shape=(STATES, ACTIONS))
+        table = cls(values)
+        table.id = file_id
+        if os.path.exists(cls.log_path(path)):
+            if mode == 'r':
+                table.values = np.array(values)
+            table.apply_log(cls.log_path(path), repair=mode != 'r')
+        return table
+
+    @staticmethod
+    def log_path(path):
+        return f'{path}.log'
+
+    def save(self, path=QVALUES_PATH):
+        """writes the whole table through a temporary file, then drops the delta log it replaces"""
+        file_id = os.urandom(8).hex()
+        header = json.dumps(dict(_grid_header(), id=file_id)).encode()
+        # pad so the values start 16 byte aligned
+        header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 16)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(4, 'little'))
+            f.write(header)
+            f.write(np.ascontiguousarray(self.values, dtype=DTYPE).tobytes())
+        os.replace(tmp, path)
+        self.id = file_id
+        try:
+            os.remove(self.log_path(path))
+        except FileNotFoundError:
+            pass
+
+    def _log_end(self, f):
+        """
+        end of the last complete record of the open log `f`, 0 when it is
+        the log of another save
+        """
+        f.seek(0)
+        if f.read(16) != self.id.encode():
+            return 0
+        size = f.seek(0, os.SEEK_END)
+        pos = 16
+        while pos + 4 <= size:
+            f.seek(pos)
+            count = int.from_bytes(f.read(4), 'little')
+            end = pos + 4 + count * (4 + ACTIONS * DTYPE.itemsize)
+            if end > size:
+                break
+            pos = end
+        return pos
+
+    def append_log(self, states, path=QVALUES_PATH):
+        """
+        appends the current rows of `states` to the delta log of the file at
+        `path`. a torn last record is cut first, a log of another save is
+        started over.
+        """
+        if self.id is None:
+            raise ValueError('The table was never saved, there is no file to log changes to')
+        states = np.asarray(states, dtype='<i4')
+        record = len(states).to_bytes(4, 'little') + states.tobytes() + \
+            np.ascontiguousarray(self.values[states], dtype=DTYPE).tobytes()
+        log_path = self.log_path(path)
+        with open(log_path, 'r+b' if os.path.exists(log_path) else 'w+b') as f:
+            end = self._log_end(f)
+            f.seek(end)
+            f.truncate()
+            if end == 0:
+                f.write(self.id.encode())
+            f.write(record)
+
+    def apply_log(self, log_path, repair=True):
+        """
+        applies the records of a delta log in order. a torn last record is
+        ignored and a log of another save is skipped, with `repair` they are
+        cut from the file so that later records are not appended behind them.
+        """
+        with open(log_path, 'r+b' if repair else 'rb') as f:
+            end = self._log_end(f)
+            f.seek(0)
+            data = f.read(end)
+            if repair and end < f.seek(0, os.SEEK_END):
+                f.truncate(end)
+        pos = 16
+        while pos < end:
+            count = int.from_bytes(data[pos:pos + 4], 'little')
+            states = np.frombuffer(data, dtype='<i4', count=count, offset=pos + 4)
+            rows = np.frombuffer(data, dtype=DTYPE, count=count * ACTIONS, offset=pos + 4 + count * 4)
+            self.values[states] = rows.reshape(count, ACTIONS)
+            pos += 4 + count * (4 + ACTIONS * DTYPE.itemsize)
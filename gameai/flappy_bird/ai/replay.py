@@ -0,0 +1,321 @@
+import os
+import json
+import numpy as np
+
+REPLAY_MEMORY = 50000  # number of previous transitions to remember
+
+
+class ReplayMemory(object):
+    """
+    Replay memory over the stream of preprocessed frames of one game.
+
+    Every slot of the pre-allocated arrays holds the frame seen after an
+    action, together with that action, its reward and terminal flag. Frames
+    are stored once, as uint8; the state before the action is rebuilt from
+    the `history` frames before the slot, newest first, and the next state
+    from the frames ending at the slot, exactly like FrameStack builds them.
+    Inserting is O(1), the oldest slot is overwritten once full.
+    """
+    FIELDS = ('frames', 'actions', 'rewards', 'terminals')
+
+    def __init__(self, capacity=REPLAY_MEMORY, frame_shape=(80, 80), history=4, actions=2, seed=None) -> None:
+        self.capacity = capacity
+        self.history = history
+        self.num_actions = actions
+        self.rng = np.random.default_rng(seed)
+        self._allocate(tuple(frame_shape))
+
+    def _allocate(self, frame_shape):
+        self.frames = np.zeros((self.capacity,) + frame_shape, dtype=np.uint8)
+        # -1 marks a frame no action led to, the first frames of the stream
+        self.actions = np.full(self.capacity, -1, dtype=np.int8)
+        self.rewards = np.zeros(self.capacity, dtype=np.float32)
+        self.terminals = np.zeros(self.capacity, dtype=bool)
+        # total number of slots ever written
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _write(self, frame, action, reward, terminal):
+        i = self.count % self.capacity
+        self.frames[i] = frame
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.terminals[i] = terminal
+        self.count += 1
+
+    def start(self, frame):
+        """begins the stream with `frame` repeated, as FrameStack.reset does"""
+        for _ in range(self.history):
+            self._write(frame, -1, 0, False)
+
+    def add(self, frame, action, reward, terminal):
+        """stores the frame seen after taking `action` (an index) and its reward"""
+        self._write(frame, action, reward, terminal)
+
+    def flush(self):
+        """nothing to write, the memory is in RAM"""
+        pass
+
+    def snapshot(self):
+        """copies of the arrays and position, to write out while the memory keeps changing"""
+        snapshot = {name: getattr(self, name).copy() for name in self.FIELDS}
+        snapshot['count'] = np.array(self.count)
+        return snapshot
+
+    def restore(self, snapshot):
+        """puts back the contents of a snapshot"""
+        for name in self.FIELDS:
+            array, value = getattr(self, name), snapshot[name]
+            if value.shape != array.shape:
+                raise ValueError(f'Expected {name} of shape {array.shape}, got {value.shape}')
+            array[...] = value
+        self.count = int(snapshot['count'])
+
+    def _stacks(self, idx):
+        """(len(idx), 80, 80, history) states whose newest frame is at idx"""
+        ix = (idx[:, None] - np.arange(self.history)[None, :]) % self.capacity
+        return np.ascontiguousarray(np.moveaxis(self.frames[ix], 1, -1))
+
+    def _sample_indices(self, samples_num):
+        # a slot can be sampled when all the frames of its state are still stored
+        low = max(0, self.count - self.capacity) + self.history
+        if self.count - low < samples_num:
+            raise ValueError(f'Only {max(0, self.count - low)} transitions stored, cannot sample {samples_num}')
+        idx = self.rng.integers(low, self.count, size=samples_num)
+        # the first frames of the stream are not transitions, draw again
+        bad = self.actions[idx % self.capacity] < 0
+        while bad.any():
+            idx[bad] = self.rng.integers(low, self.count, size=int(bad.sum()))
+            bad = self.actions[idx % self.capacity] < 0
+        return idx
+
+    def sample(self, samples_num):
+        """
+        returns batch arrays of states, one-hot actions, rewards, next states
+        and terminal flags of `samples_num` random transitions
+        """
+        return self._batch(self._sample_indices(samples_num))
+
+    def _batch(self, idx):
+        slots = idx % self.capacity
+        train_s = self._stacks(idx - 1)
+        train_s_ = self._stacks(idx)
+        train_a = np.zeros((len(idx), self.num_actions), dtype=np.float32)
+        train_a[np.arange(len(idx)), self.actions[slots]] = 1
+        return train_s, train_a, self.rewards[slots], train_s_, self.terminals[slots]
+
+
+class MemmapReplayMemory(ReplayMemory):
+    """
+    ReplayMemory whose arrays live in .npy files memory-mapped from `path`.
+
+    The write position is kept in meta.json next to them, so a training run
+    that opens the same directory again resumes with its experience. Several
+    processes on one host can open it: one writer with mode 'r+', which
+    creates the files if needed, and any number of readers with mode 'r',
+    which pick up the writer's progress before each sample. The writer
+    publishes its progress every `flush_every` transitions and on `flush`.
+    Readers may sample slots the writer is overwriting at that moment, an
+    occasional stale transition a replay memory can live with.
+    """
+    def __init__(self, path, capacity=REPLAY_MEMORY, frame_shape=(80, 80), history=4, actions=2,
+                 seed=None, mode='r+', flush_every=1000) -> None:
+        if mode not in ('r', 'r+'):
+            raise ValueError(f'Unknown mode {mode}')
+        self.path = path
+        self.mode = mode
+        self.flush_every = flush_every
+        super().__init__(capacity, frame_shape, history, actions, seed)
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.path, 'meta.json')
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _allocate(self, frame_shape):
+        meta = self._read_meta()
+        if meta is None:
+            if self.mode == 'r':
+                raise FileNotFoundError(f'No replay memory in {self.path}')
+            self._create(frame_shape)
+            return
+
+        if meta['capacity'] != self.capacity or tuple(meta['frame_shape']) != frame_shape \
+                or meta['history'] != self.history:
+            raise ValueError(
+                f'Replay memory in {self.path} has capacity {meta["capacity"]}, frames {meta["frame_shape"]} '
+                f'and history {meta["history"]}, expected {self.capacity}, {list(frame_shape)} and {self.history}')
+        for name in self.FIELDS:
+            setattr(self, name, np.lib.format.open_memmap(os.path.join(self.path, f'{name}.npy'), mode=self.mode))
+        self.count = meta['count']
+
+    def _create(self, frame_shape):
+        os.makedirs(self.path, exist_ok=True)
+        shapes = {
+            'frames': ((self.capacity,) + frame_shape, np.uint8),
+            'actions': ((self.capacity,), np.int8),
+            'rewards': ((self.capacity,), np.float32),
+            'terminals': ((self.capacity,), bool),
+        }
+        for name in self.FIELDS:
+            shape, dtype = shapes[name]
+            array = np.lib.format.open_memmap(os.path.join(self.path, f'{name}.npy'), mode='w+',
+                                              dtype=dtype, shape=shape)
+            setattr(self, name, array)
+        self.actions[:] = -1
+        self.count = 0
+        self.flush()
+
+    def _write(self, frame, action, reward, terminal):
+        super()._write(frame, action, reward, terminal)
+        if self.count % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        """writes the arrays to disk, then the position, through a temporary file"""
+        for name in self.FIELDS:
+            getattr(self, name).flush()
+        meta = {
+            'capacity': self.capacity,
+            'frame_shape': list(self.frames.shape[1:]),
+            'history': self.history,
+            'count': self.count,
+        }
+        tmp = f'{self.meta_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.meta_path)
+
+    def snapshot(self):
+        """the files are the snapshot, only flushes them"""
+        self.flush()
+        return None
+
+    def refresh(self):
+        """reads the writer's position"""
+        self.count = self._read_meta()['count']
+
+    def sample(self, samples_num):
+        if self.mode == 'r':
+            self.refresh()
+        return super().sample(samples_num)
+
+
+class SumTree(object):
+    """
+    Binary tree of priorities stored in one array, every node holds the sum
+    of its children.
+
+    Leaves are at `size + i` for i < capacity, node k has children 2k and
+    2k + 1, the root at 1 holds the total. Updating and finding a leaf walk
+    one root to leaf path, both take arrays and walk all their paths at once.
+    """
+    def __init__(self, capacity) -> None:
+        self.capacity = capacity
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.depth = self.size.bit_length() - 1
+        self.tree = np.zeros(2 * self.size, dtype=np.float64)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def __getitem__(self, idx):
+        return self.tree[np.asarray(idx) + self.size]
+
+    def update(self, idx, priorities):
+        """sets the priorities of leaves `idx` and the sums above them"""
+        nodes = np.asarray(idx, dtype=np.int64) + self.size
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """returns the leaves where the running sum of priorities passes each value"""
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            right = values >= self.tree[left]
+            values -= np.where(right, self.tree[left], 0)
+            nodes = left + right
+        return nodes - self.size
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    """
+    ReplayMemory sampling transitions in proportion to priority ** alpha.
+
+    New transitions get the highest priority seen so far, so each is sampled
+    at least once; the learner then sets priorities from its TD errors with
+    `update_priorities`. Importance sampling weights undo the bias of the
+    non uniform sampling, with beta annealed to 1 by `beta_increment` per
+    sample.
+    """
+    def __init__(self, capacity=REPLAY_MEMORY, frame_shape=(80, 80), history=4, actions=2, seed=None,
+                 alpha=0.6, beta=0.4, beta_increment=1.0e-6, epsilon=1.0e-6) -> None:
+        super().__init__(capacity, frame_shape, history, actions, seed)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self.priorities = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def _write(self, frame, action, reward, terminal):
+        # the oldest frame goes, the transition whose state needed it can no longer be sampled
+        stale = self.count - self.capacity + self.history
+        slot = self.count % self.capacity
+        super()._write(frame, action, reward, terminal)
+        self.priorities.update([slot], self.max_priority if action >= 0 else 0)
+        if stale >= 0:
+            self.priorities.update([stale % self.capacity], 0)
+
+    def sample(self, samples_num):
+        """
+        like ReplayMemory.sample, followed by the importance sampling weights
+        and the slots of the transitions, to pass to update_priorities
+        """
+        total = self.priorities.total
+        if total <= 0:
+            raise ValueError('No transitions stored')
+        # one value in each of samples_num equal segments of the total
+        values = (np.arange(samples_num) + self.rng.random(samples_num)) * (total / samples_num)
+        slots = self.priorities.find(np.minimum(values, np.nextafter(total, 0)))
+        # rounding can land on an empty leaf, draw those again
+        bad = self.priorities[slots] <= 0
+        while bad.any():
+            slots[bad] = self.priorities.find(self.rng.random(int(bad.sum())) * total)
+            bad = self.priorities[slots] <= 0
+
+        probabilities = self.priorities[slots] / total
+        weights = (len(self) * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return self._batch(slots) + (weights.astype(np.float32), slots)
+
+    def restore(self, snapshot):
+        """puts back a snapshot, every transition that can be sampled gets the highest priority"""
+        super().restore(snapshot)
+        self.priorities = SumTree(self.capacity)
+        low = max(0, self.count - self.capacity) + self.history
+        slots = np.arange(low, self.count) % self.capacity
+        slots = slots[self.actions[slots] >= 0]
+        if len(slots):
+            self.priorities.update(slots, self.max_priority)
+
+    def update_priorities(self, slots, td_errors):
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.priorities.update(slots, priorities)
@@ -0,0 +1,182 @@
+"""
+Bitmask collision engine.
+
+Hitmasks are NumPy bool arrays indexed (x, y); two masks collide when the
+AND of their overlapping slices has any pixel set.
+"""
+import os
+import hashlib
+import numpy as np
+
+
+def pixelCollision(rect1, rect2, hitmask1, hitmask2):
+    """Checks if two objects collide and not just their rects, rects are (x, y, w, h)"""
+    left = max(rect1[0], rect2[0])
+    top = max(rect1[1], rect2[1])
+    width = min(rect1[0] + rect1[2], rect2[0] + rect2[2]) - left
+    height = min(rect1[1] + rect1[3], rect2[1] + rect2[3]) - top
+
+    if width <= 0 or height <= 0:
+        return False
+
+    x1, y1 = left - rect1[0], top - rect1[1]
+    x2, y2 = left - rect2[0], top - rect2[1]
+
+    return bool(np.any(
+        np.asarray(hitmask1)[x1:x1 + width, y1:y1 + height]
+        & np.asarray(hitmask2)[x2:x2 + width, y2:y2 + height]
+    ))
+
+
+class CollisionEngine(object):
+    """
+    Player vs pipe collisions by integer offset.
+
+    The pipe masks are padded by a player size on every side, so the player
+    window at any offset whose rects overlap is a plain slice of the padded
+    mask. Offsets (dx, dy) are the player's top-left corner minus the pipe's.
+    """
+    def __init__(self, player_masks, pipe_masks) -> None:
+        # (frame, x, y) and (kind, x, y), kind 0 is the upper pipe, 1 the lower
+        self.player_masks = np.array(player_masks, dtype=bool)
+        self.pipe_masks = np.array(pipe_masks, dtype=bool)
+        _, self.player_w, self.player_h = self.player_masks.shape
+        _, self.pipe_w, self.pipe_h = self.pipe_masks.shape
+        self.padded = np.pad(
+            self.pipe_masks,
+            ((0, 0), (self.player_w, self.player_w), (self.player_h, self.player_h)),
+        )
+
+    @property
+    def key(self):
+        """digest of the hitmasks, a saved table is only valid for the same masks"""
+        digest = hashlib.sha1()
+        for masks in (self.player_masks, self.pipe_masks):
+            digest.update(str(masks.shape).encode())
+            digest.update(np.packbits(masks).tobytes())
+        return digest.hexdigest()
+
+    def overlaps(self, dx, dy):
+        """True where the player and pipe rects overlap"""
+        return (dx > -self.player_w) & (dx < self.pipe_w) & (dy > -self.player_h) & (dy < self.pipe_h)
+
+    def collide(self, frame, kind, dx, dy):
+        """returns True if player `frame` at offset (dx, dy) hits pipe `kind`"""
+        if not self.overlaps(dx, dy):
+            return False
+        x, y = dx + self.player_w, dy + self.player_h
+        window = self.padded[kind, x:x + self.player_w, y:y + self.player_h]
+        return bool((window & self.player_masks[frame]).any())
+
+    def collide_batch(self, frame, kind, dx, dy):
+        """
+        collide for many pairs at once, e.g. many birds against many pipes.
+
+        the arguments are broadcast against each other, returns a bool array
+        of the broadcast shape.
+        """
+        frame, kind, dx, dy = np.broadcast_arrays(*(np.asarray(a, dtype=np.int64) for a in (frame, kind, dx, dy)))
+        hit = np.zeros(dx.shape, dtype=bool)
+        # rect test first, only overlapping pairs need a pixel test
+        near = self.overlaps(dx, dy)
+        if not near.any():
+            return hit
+        ix = (dx[near] + self.player_w)[:, None, None] + np.arange(self.player_w)[None, :, None]
+        iy = (dy[near] + self.player_h)[:, None, None] + np.arange(self.player_h)[None, None, :]
+        window = self.padded[kind[near][:, None, None], ix, iy]
+        hit[near] = (window & self.player_masks[frame[near]]).any(axis=(1, 2))
+        return hit
+
+
+class CollisionTable(CollisionEngine):
+    """
+    CollisionEngine answering from a precomputed table.
+
+    There are only three player frames and two pipe masks, so every outcome
+    is a pure function of (frame, kind, dx, dy) over the offsets where the
+    rects overlap. The table holds all of them and a collision test becomes
+    a single lookup.
+    """
+    def __init__(self, player_masks, pipe_masks, table=None) -> None:
+        super().__init__(player_masks, pipe_masks)
+        if table is None:
+            table = self._build()
+        expected = (len(self.player_masks), len(self.pipe_masks)) + self.offsets_shape
+        if table.shape != expected:
+            raise ValueError(f'Expected a collision table of shape {expected}, got {table.shape}')
+        self.table = table
+
+    @property
+    def offsets_shape(self):
+        return (self.player_w + self.pipe_w - 1, self.player_h + self.pipe_h - 1)
+
+    def _build(self):
+        dx = np.arange(1 - self.player_w, self.pipe_w)[:, None]
+        dy = np.arange(1 - self.player_h, self.pipe_h)[None, :]
+        table = np.zeros((len(self.player_masks), len(self.pipe_masks)) + self.offsets_shape, dtype=bool)
+        for frame in range(len(self.player_masks)):
+            for kind in range(len(self.pipe_masks)):
+                table[frame, kind] = CollisionEngine.collide_batch(self, frame, kind, dx, dy)
+        return table
+
+    def collide(self, frame, kind, dx, dy):
+        if not self.overlaps(dx, dy):
+            return False
+        return bool(self.table[frame, kind, dx + self.player_w - 1, dy + self.player_h - 1])
+
+    def collide_batch(self, frame, kind, dx, dy):
+        frame, kind, dx, dy = np.broadcast_arrays(*(np.asarray(a, dtype=np.int64) for a in (frame, kind, dx, dy)))
+        hit = np.zeros(dx.shape, dtype=bool)
+        near = self.overlaps(dx, dy)
+        hit[near] = self.table[frame[near], kind[near], dx[near] + self.player_w - 1, dy[near] + self.player_h - 1]
+        return hit
+
+    def verify(self):
+        """checks every entry of the table against pixelCollision, raises RuntimeError on a mismatch"""
+        player_rect = (0, 0, self.player_w, self.player_h)
+        for frame, kind, i, j in np.ndindex(*self.table.shape):
+            dx, dy = i - self.player_w + 1, j - self.player_h + 1
+            pipe_rect = (-dx, -dy, self.pipe_w, self.pipe_h)
+            expected = pixelCollision(player_rect, pipe_rect,
+                                      self.player_masks[frame], self.pipe_masks[kind])
+            if expected != self.table[frame, kind, i, j]:
+                raise RuntimeError(
+                    f'collision table disagrees with pixelCollision at frame={frame} '
+                    f'kind={kind} dx={dx} dy={dy}')
+
+    def save(self, path):
+        """writes the table bit-packed, through a temporary file so readers never see half a table"""
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, np.packbits(self.table, axis=-1))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, player_masks, pipe_masks, path):
+        rows = np.shape(player_masks)[2] + np.shape(pipe_masks)[2] - 1
+        table = np.unpackbits(np.load(path), axis=-1, count=rows).astype(bool)
+        return cls(player_masks, pipe_masks, table=table)
+
+
+def loadCollisionTable(player_masks, pipe_masks, cache_dir, verify=False):
+    """
+    returns a CollisionTable for the masks, read from `cache_dir` when it was
+    built before and built and saved there otherwise.
+
+    verify: check the table against pixelCollision before returning it
+    """
+    engine = CollisionEngine(player_masks, pipe_masks)
+    path = os.path.join(cache_dir, f'collision-{engine.key[:16]}.npy')
+    try:
+        table = CollisionTable.load(player_masks, pipe_masks, path)
+    except (IOError, ValueError):
+        table = CollisionTable(player_masks, pipe_masks)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            table.save(path)
+        except OSError:
+            # read-only install, build again next time
+            pass
+    if verify:
+        table.verify()
+    return table
@@ -0,0 +1,308 @@
+"""
+Headless core of the game: dimensions, hitmasks and collision rules.
+
+Nothing here imports pygame, the pygame display, mixer and images live in
+settings.py and are only needed to render a game.
+"""
+import os
+import random
+import struct
+import hashlib
+import zlib
+import pathlib
+import numpy as np
+
+from gameai.flappy_bird.game.collision import CollisionEngine, loadCollisionTable, pixelCollision
+
+RELATIVE_PATH = str(pathlib.Path(__file__).absolute().parent)
+# files derived from the assets, rebuilt when missing
+CACHE_DIR = f'{RELATIVE_PATH}/cache'
+
+FPS = 30
+SCREENWIDTH = 288
+SCREENHEIGHT = 512
+PIPEGAPSIZE = 100   # gap between upper and lower part of pipe
+BASEY = SCREENHEIGHT * 0.79
+
+# list of all possible players (tuple of 3 positions of flap)
+PLAYERS_LIST = (
+    # red bird
+    (
+        f'{RELATIVE_PATH}/assets/sprites/redbird-upflap.png',
+        f'{RELATIVE_PATH}/assets/sprites/redbird-midflap.png',
+        f'{RELATIVE_PATH}/assets/sprites/redbird-downflap.png',
+    ),
+    # blue bird
+    (
+        f'{RELATIVE_PATH}/assets/sprites/bluebird-upflap.png',
+        f'{RELATIVE_PATH}/assets/sprites/bluebird-midflap.png',
+        f'{RELATIVE_PATH}/assets/sprites/bluebird-downflap.png',
+    ),
+    # yellow bird
+    (
+        f'{RELATIVE_PATH}/assets/sprites/yellowbird-upflap.png',
+        f'{RELATIVE_PATH}/assets/sprites/yellowbird-midflap.png',
+        f'{RELATIVE_PATH}/assets/sprites/yellowbird-downflap.png',
+    ),
+)
+
+# list of backgrounds
+BACKGROUNDS_LIST = (
+    f'{RELATIVE_PATH}/assets/sprites/background-day.png',
+    f'{RELATIVE_PATH}/assets/sprites/background-night.png',
+)
+
+# list of pipes
+PIPES_LIST = (
+    f'{RELATIVE_PATH}/assets/sprites/pipe-green.png',
+    f'{RELATIVE_PATH}/assets/sprites/pipe-red.png',
+)
+
+BASE_PATH = f'{RELATIVE_PATH}/assets/sprites/base.png'
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _readChunks(path):
+    """returns the IHDR fields and the PLTE, tRNS and IDAT data of a png"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError(f'{path} is not a png file')
+
+    chunks = {b'PLTE': b'', b'tRNS': b'', b'IDAT': b''}
+    pos = 8
+    while pos < len(data):
+        length, ctype = struct.unpack('>I4s', data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        if ctype == b'IHDR':
+            header = struct.unpack('>IIBBBBB', body)
+        elif ctype in chunks:
+            chunks[ctype] += body
+        pos += length + 12
+    return header, chunks
+
+
+def pngSize(path):
+    """returns (width, height) of a png file"""
+    with open(path, 'rb') as f:
+        data = f.read(24)
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError(f'{path} is not a png file')
+    return struct.unpack('>II', data[16:24])
+
+
+def _unfilter(raw, height, stride, bpp):
+    """reverses the png scanline filters, returns a (height, stride) uint8 array"""
+    rows = np.frombuffer(raw, dtype=np.uint8).reshape(height, stride + 1)
+    out = np.zeros((height + 1, stride), dtype=np.int64)   # row 0 is the empty prior row
+    for y in range(height):
+        ftype, line = rows[y, 0], rows[y, 1:].astype(np.int64)
+        prior = out[y]
+        if ftype == 0:      # None
+            out[y + 1] = line
+        elif ftype == 1:    # Sub: cumulative sum over each byte lane
+            lanes = np.zeros(-(-stride // bpp) * bpp, dtype=np.int64)
+            lanes[:stride] = line
+            out[y + 1] = np.cumsum(lanes.reshape(-1, bpp), axis=0).reshape(-1)[:stride] & 0xFF
+        elif ftype == 2:    # Up
+            out[y + 1] = (line + prior) & 0xFF
+        elif ftype in (3, 4):
+            # Average and Paeth depend on the byte just decoded
+            cur = out[y + 1]
+            for x in range(stride):
+                a = cur[x - bpp] if x >= bpp else 0
+                b = prior[x]
+                if ftype == 3:
+                    cur[x] = (line[x] + (a + b) // 2) & 0xFF
+                    continue
+                c = prior[x - bpp] if x >= bpp else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                pred = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+                cur[x] = (line[x] + pred) & 0xFF
+        else:
+            raise ValueError(f'unknown png filter type {ftype}')
+    return out[1:].astype(np.uint8)
+
+
+def readAlpha(path):
+    """returns the alpha channel of a png file as a (width, height) uint8 array"""
+    header, chunks = _readChunks(path)
+    width, height, depth, ctype, _, _, interlace = header
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[ctype]
+    if interlace or depth == 16:
+        raise ValueError(f'{path}: interlaced and 16 bit pngs are not supported')
+
+    stride = (width * channels * depth + 7) // 8
+    bpp = max(1, channels * depth // 8)
+    rows = _unfilter(zlib.decompress(chunks[b'IDAT']), height, stride, bpp)
+
+    if ctype == 3:
+        # palette indices, alpha comes from tRNS (opaque past its end)
+        indices = np.unpackbits(rows, axis=1).reshape(height, -1, depth)
+        indices = indices.dot(1 << np.arange(depth - 1, -1, -1))[:, :width]
+        palette_alpha = np.full(256, 255, dtype=np.uint8)
+        palette_alpha[:len(chunks[b'tRNS'])] = np.frombuffer(chunks[b'tRNS'], dtype=np.uint8)
+        alpha = palette_alpha[indices]
+    elif ctype in (4, 6):
+        alpha = rows.reshape(height, width, channels)[:, :, -1]
+    else:
+        alpha = np.full((height, width), 255, dtype=np.uint8)
+    # (x, y) indexing, as pygame surfaces and hitmasks use
+    return np.ascontiguousarray(alpha.T)
+
+
+def loadHitmask(path, flip=False):
+    """returns a hitmask using a png file's alpha, optionally flipped vertically."""
+    mask = readAlpha(path) > 0
+    if flip:
+        mask = mask[:, ::-1]
+    return np.ascontiguousarray(mask)
+
+
+def _spritesDigest(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def loadHitmasks(cache_dir=CACHE_DIR):
+    """
+    returns the pipe and player hitmasks.
+
+    hitmasks do not depend on the skin, every bird and every pipe sprite has
+    the same shape, so the first of each list is used. The masks are kept
+    bit-packed in `cache_dir` under the digest of the sprite files and only
+    decoded from the pngs when the sprites change.
+    """
+    sprites = (PIPES_LIST[0],) + PLAYERS_LIST[0]
+    path = f'{cache_dir}/hitmasks-{_spritesDigest(sprites)[:16]}.npz'
+    try:
+        with np.load(path) as cached:
+            masks = [np.unpackbits(cached[f'mask{i}'], count=int(np.prod(cached[f'shape{i}'])))
+                     .astype(bool).reshape(cached[f'shape{i}']) for i in range(len(sprites))]
+    except (IOError, ValueError, KeyError):
+        masks = [loadHitmask(sprite) for sprite in sprites]
+        arrays = {}
+        for i, mask in enumerate(masks):
+            arrays[f'mask{i}'] = np.packbits(mask)
+            arrays[f'shape{i}'] = np.array(mask.shape)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, path)
+        except OSError:
+            # read-only install, decode again next time
+            pass
+
+    pipe, players = masks[0], masks[1:]
+    return {
+        # upper pipe is the flipped sprite
+        'pipe': (np.ascontiguousarray(pipe[:, ::-1]), pipe),
+        'player': tuple(players),
+    }
+
+
+HITMASKS = loadHitmasks()
+
+PLAYER_WIDTH, PLAYER_HEIGHT = HITMASKS['player'][0].shape
+PIPE_WIDTH, PIPE_HEIGHT = HITMASKS['pipe'][0].shape
+BACKGROUND_WIDTH = pngSize(BACKGROUNDS_LIST[0])[0]
+BASE_WIDTH = pngSize(BASE_PATH)[0]
+
+COLLISION = CollisionEngine(HITMASKS['player'], HITMASKS['pipe'])
+
+
+def useCollisionTable(verify=False):
+    """
+    switches checkCrash to a precomputed collision table, built once and
+    cached in CACHE_DIR.
+
+    verify: check every entry of the table against pixelCollision first
+    """
+    global COLLISION
+    COLLISION = loadCollisionTable(HITMASKS['player'], HITMASKS['pipe'], CACHE_DIR, verify=verify)
+    return COLLISION
+
+
+# gap y of the pipes are drawn from [GAP_MIN, GAP_MIN + GAP_RANGE)
+GAP_MIN = int(BASEY * 0.2)
+GAP_RANGE = int(BASEY * 0.6 - PIPEGAPSIZE)
+
+
+def pipesAt(gapY):
+    """returns the upper and lower pipe of a gap starting at gapY"""
+    pipeHeight = PIPE_HEIGHT
+    pipeX = SCREENWIDTH + 10
+
+    pipes = [
+        {'x': pipeX, 'y': gapY - pipeHeight},  # upper pipe
+        {'x': pipeX, 'y': gapY + PIPEGAPSIZE}  # lower pipe
+    ]
+    return pipes
+
+
+def getRandomPipe(rng=random):
+    """returns a randomly generated pipe, drawn from `rng`, a random.Random"""
+    # y of gap between upper and lower pipe
+    gapY = rng.randrange(0, GAP_RANGE)
+    gapY += GAP_MIN
+    return pipesAt(gapY)
+
+
+def randomPipeGaps(size, seed=None):
+    """
+    returns an int64 array of `size` random gap y, a course of pipes for
+    Game(pipe_gaps=...) and VectorGame
+
+    seed: seed or numpy Generator to draw from
+    """
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, GAP_RANGE, size=size) + GAP_MIN
+
+
+def checkCrash(player, upperPipes, lowerPipes):
+    """returns True if player collides with base or pipes."""
+    pi = player['index']
+    player['w'] = PLAYER_WIDTH
+    player['h'] = PLAYER_HEIGHT
+
+    # if player crashes into ceil
+    if player['y'] + player['h'] >= BASEY - 1:
+        return [True, True]
+
+    else:
+        # integer offsets, positions are truncated the way pygame.Rect does
+        px, py = int(player['x']), int(player['y'])
+
+        for uPipe, lPipe in zip(upperPipes, lowerPipes):
+            # if bird collided with upipe or lpipe
+            uCollide = COLLISION.collide(pi, 0, px - int(uPipe['x']), py - int(uPipe['y']))
+            lCollide = COLLISION.collide(pi, 1, px - int(lPipe['x']), py - int(lPipe['y']))
+
+            if uCollide or lCollide:
+                return [True, False]
+
+    return [False, False]
+
+
+def playerShm(playerShm):
+    """SHM: 简谐运动
+    当某物体进行简谐运动时，物体所受的力跟位移成正比，并且总是指向平衡位置。它是一种由自身系统性质决定的周期性运动（如单摆运动和弹簧振子运动）。实际上简谐振动就是正弦振动：　X = A*cos(w*t + epsilon)
+
+    oscillates the value of playerShm['val'] between 8 and -8
+    val: -8 to 8
+    dir: direction: -1, 1 (down, up)
+    """
+    if abs(playerShm['val']) == 8:
+        playerShm['dir'] *= -1
+
+    if playerShm['dir'] == 1:
+        playerShm['val'] += 1
+    else:
+        playerShm['val'] -= 1
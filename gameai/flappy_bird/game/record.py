@@ -0,0 +1,164 @@
+"""
+Recording of games as their seed and actions, and replays of them.
+
+A game is fully determined by its seed, or its pipe course, and the action
+of every frame, so that is all a recording keeps: one bit per frame. The
+physics state of every frame can be kept too, to check that a replay
+follows the recorded game.
+
+The file is MAGIC, the length of a JSON header as a little endian uint32,
+the header, the bit-packed actions and, when recorded, the (steps, 3)
+float64 playery, playerVelY and score of every frame, after its step.
+
+    python -m gameai.flappy_bird.game.record replay game.rec --render
+"""
+import os
+import json
+import argparse
+import numpy as np
+
+from gameai.flappy_bird.game.core import FPS
+from gameai.flappy_bird.game.run import Game
+
+MAGIC = b'FBREC001'
+STATE_FIELDS = ('playery', 'playerVelY', 'score')
+
+
+class Recorder(object):
+    """
+    Plays a new Game and records it.
+
+    The recorder stands in for the game: frame_step is recorded and every
+    other attribute is the game's, so it can be passed to e.g. bot.bot_step.
+
+    seed, pipe_gaps: see Game, one of them is needed to replay the game
+    record_state: keep the physics state of every frame as well
+    game_kwargs: other arguments of Game, e.g. daemon
+    """
+    def __init__(self, seed=None, pipe_gaps=None, record_state=False, **game_kwargs) -> None:
+        if seed is None and pipe_gaps is None:
+            raise ValueError('A game without seed or pipe_gaps can not be replayed')
+        self.game = Game(seed=seed, pipe_gaps=pipe_gaps, **game_kwargs)
+        self.pipe_gaps = None if pipe_gaps is None else [int(gap) for gap in pipe_gaps]
+        self.record_state = record_state
+        # grown as needed, the first `steps` rows are recorded
+        self.actions = np.zeros(4096, dtype=np.uint8)
+        self.states = np.zeros((4096 if record_state else 0, len(STATE_FIELDS)), dtype=np.float64)
+        self.steps = 0
+
+    def __getattr__(self, name):
+        return getattr(self.game, name)
+
+    def frame_step(self, input_actions):
+        result = self.game.frame_step(input_actions)
+        if self.steps == len(self.actions):
+            self.actions = np.concatenate((self.actions, np.zeros_like(self.actions)))
+            if self.record_state:
+                self.states = np.concatenate((self.states, np.zeros_like(self.states)))
+        self.actions[self.steps] = input_actions[1]
+        if self.record_state:
+            self.states[self.steps] = [getattr(self.game, field) for field in STATE_FIELDS]
+        self.steps += 1
+        return result
+
+    def save(self, path):
+        """writes the recording through a temporary file, it can be saved again as it grows"""
+        skins = None
+        if self.game.renderer is not None:
+            assets = self.game.renderer.assets
+            skins = [assets.player, assets.background, assets.pipe]
+        header = json.dumps({'seed': self.game.seed, 'pipe_gaps': self.pipe_gaps, 'steps': self.steps,
+                             'state': self.record_state, 'skins': skins}).encode()
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(4, 'little'))
+            f.write(header)
+            f.write(np.packbits(self.actions[:self.steps]).tobytes())
+            if self.record_state:
+                f.write(self.states[:self.steps].astype('<f8').tobytes())
+        os.replace(tmp, path)
+
+
+class Replayer(object):
+    """
+    Replays a recording, headless at full speed or rendered.
+
+    actions: (steps,) uint8 action of every frame, 1 to flap
+    states: (steps, 3) recorded physics state, None when not recorded
+    """
+    def __init__(self, path) -> None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a game recording')
+        size = int.from_bytes(data[len(MAGIC):len(MAGIC) + 4], 'little')
+        pos = len(MAGIC) + 4
+        header = json.loads(data[pos:pos + size])
+        pos += size
+        self.seed = header['seed']
+        self.pipe_gaps = header['pipe_gaps']
+        self.steps = header['steps']
+        # player, background and pipe skin of a rendered recording
+        self.skins = header['skins']
+
+        packed = (self.steps + 7) // 8
+        self.actions = np.unpackbits(np.frombuffer(data, dtype=np.uint8, count=packed, offset=pos),
+                                     count=self.steps)
+        pos += packed
+        self.states = None
+        if header['state']:
+            self.states = np.frombuffer(data, dtype='<f8', count=self.steps * len(STATE_FIELDS),
+                                        offset=pos).reshape(self.steps, len(STATE_FIELDS))
+
+    def frames(self, daemon=True, **game_kwargs):
+        """
+        replays the game, yields the (image_data, reward, terminal) of every
+        frame_step. raises ValueError when the game leaves the recorded
+        states, e.g. after the rules changed.
+
+        game_kwargs: other arguments of Game, e.g. fps or obs_mode. rendered
+                     replays use the recorded skins unless assets is given
+        """
+        if not daemon and self.skins is not None and 'assets' not in game_kwargs:
+            from gameai.flappy_bird.game.settings import AssetManager
+            game_kwargs['assets'] = AssetManager(*self.skins)
+        game = Game(daemon=daemon, seed=self.seed, pipe_gaps=self.pipe_gaps, **game_kwargs)
+        input_actions = [1, 0]
+        for t, action in enumerate(self.actions):
+            input_actions[0], input_actions[1] = 1 - action, action
+            result = game.frame_step(input_actions)
+            if self.states is not None:
+                state = [getattr(game, field) for field in STATE_FIELDS]
+                if state != self.states[t].tolist():
+                    raise ValueError(f'The replay left the recording at step {t}: '
+                                     f'{dict(zip(STATE_FIELDS, state))} instead of '
+                                     f'{dict(zip(STATE_FIELDS, self.states[t].tolist()))}')
+            yield result
+
+    def replay(self, daemon=True, **game_kwargs):
+        """plays the whole recording, returns the scores of the games that ended in it"""
+        scores = []
+        score = 0
+        for _, reward, terminal in self.frames(daemon=daemon, **game_kwargs):
+            if terminal:
+                scores.append(score)
+                score = 0
+            elif reward == 1:
+                score += 1
+        return scores
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Game recordings")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="replay a recording")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--render", action="store_true", help="show the game, headless when not set")
+    replay_parser.add_argument("--fps", type=int, default=FPS, help="frame rate when rendered, 0 for full speed")
+    args = parser.parse_args()
+
+    replayer = Replayer(args.path)
+    kwargs = {'fps': args.fps or None} if args.render else {}
+    scores = replayer.replay(daemon=not args.render, **kwargs)
+    print(f'{replayer.steps} frames, {len(scores)} games, scores: {scores}')
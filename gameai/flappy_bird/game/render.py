@@ -0,0 +1,140 @@
+import numpy as np
+import pygame
+
+from gameai.flappy_bird.game.settings import *
+
+# cv2.COLOR_BGR2GRAY weights in 14 bit fixed point, for channels in the order
+# B, G, R. The trainers apply it to pygame's RGB frames, so R gets 0.114.
+GRAY_WEIGHTS = np.array([1868, 9617, 4899], dtype=np.uint32)
+
+
+class Renderer(object):
+    """
+    Draws a `Game` and plays its sounds.
+
+    Only created for games that are not run as daemon; images and sounds come
+    from `assets`. Frames are drawn on an off-screen surface and copied to
+    the window every `show_every` frames, 0 never shows them and keeps the
+    window hidden. `fps` caps the frame rate of shown frames, None runs at
+    full speed.
+
+    `obs_mode` selects what `update` returns for each frame:
+        'rgb': a new (288, 512, 3) copy of the frame
+        'buffer': the frame copied into one (288, 512, 3) array that is
+                  reused, and overwritten, every frame
+        'gray': the frame scaled to `obs_size` and converted to grayscale
+                into one reused uint8 array, (x, y) indexed like the
+                frames the DQN agents preprocess
+    """
+    def __init__(self, assets=None, fps=FPS, show_every=1, obs_mode='rgb', obs_size=(80, 80)) -> None:
+        if obs_mode not in ('rgb', 'buffer', 'gray'):
+            raise ValueError(f'Unknown observation mode {obs_mode}')
+        self.assets = assets if assets is not None else AssetManager()
+        self.fps = fps
+        self.show_every = show_every
+        self.obs_mode = obs_mode
+        self.frame = 0
+
+        pygame.display.init()
+        pygame.display.set_caption('Flappy Bird')
+        # images are converted for the display, so a mode is set even when hidden
+        flags = pygame.HIDDEN if show_every == 0 else 0
+        self.screen = pygame.display.set_mode((SCREENWIDTH, SCREENHEIGHT), flags)
+        self.surface = pygame.Surface((SCREENWIDTH, SCREENHEIGHT)).convert()
+        self.clock = pygame.time.Clock()
+
+        # observation buffers, allocated once
+        if obs_mode == 'buffer':
+            self.obs = np.zeros((SCREENWIDTH, SCREENHEIGHT, 3), dtype=np.uint8)
+        elif obs_mode == 'gray':
+            self.small = pygame.Surface(obs_size).convert()
+            self._rgb = np.zeros(tuple(obs_size) + (3,), dtype=np.uint8)
+            self._acc = np.zeros(obs_size, dtype=np.uint32)
+            self._tmp = np.zeros(obs_size, dtype=np.uint32)
+            self.obs = np.zeros(obs_size, dtype=np.uint8)
+
+    @property
+    def shown(self):
+        """True if the current frame goes to the window"""
+        return self.show_every > 0 and self.frame % self.show_every == 0
+
+    def pump(self):
+        if self.shown:
+            pygame.event.pump()
+
+    def play(self, sound):
+        self.assets.play(sound)
+
+    def gameover(self):
+        self.surface.blit(self.assets.images['gameover'], (50, 180))
+
+    def draw(self, game):
+        images = self.assets.images
+        self._draw_sprites(game, images)
+        self._draw_score(game, images)
+        self._draw_player(game, images)
+
+    def observe(self):
+        """returns the pixels of the drawn frame, see obs_mode"""
+        if self.obs_mode == 'rgb':
+            return pygame.surfarray.array3d(self.surface)
+        if self.obs_mode == 'buffer':
+            pygame.pixelcopy.surface_to_array(self.obs, self.surface)
+            return self.obs
+
+        pygame.transform.scale(self.surface, self.small.get_size(), self.small)
+        pygame.pixelcopy.surface_to_array(self._rgb, self.small)
+        # fixed point grayscale, see GRAY_WEIGHTS
+        np.multiply(self._rgb[:, :, 0], GRAY_WEIGHTS[0], out=self._acc)
+        np.multiply(self._rgb[:, :, 1], GRAY_WEIGHTS[1], out=self._tmp)
+        self._acc += self._tmp
+        np.multiply(self._rgb[:, :, 2], GRAY_WEIGHTS[2], out=self._tmp)
+        self._acc += self._tmp
+        self._acc += 1 << 13
+        self._acc >>= 14
+        np.copyto(self.obs, self._acc, casting='unsafe')
+        return self.obs
+
+    def update(self):
+        """shows the drawn frame if it is due and returns its pixels"""
+        image_data = self.observe()
+        if self.shown:
+            self.screen.blit(self.surface, (0, 0))
+            pygame.display.update()
+            if self.fps:
+                self.clock.tick(self.fps)
+        self.frame += 1
+        return image_data
+
+    def _draw_sprites(self, game, images):
+        # draw sprites
+        self.surface.blit(images['background'], (0, 0))
+
+        for uPipe, lPipe in zip(game.upperPipes, game.lowerPipes):
+            self.surface.blit(images['pipe'][0], (uPipe['x'], uPipe['y']))
+            self.surface.blit(images['pipe'][1], (lPipe['x'], lPipe['y']))
+
+        self.surface.blit(images['base'], (game.basex, BASEY))
+
+    def _draw_score(self, game, images):
+        """displays score in center of screen"""
+        scoreDigits = [int(x) for x in list(str(game.score))]
+        totalWidth = 0   # total width of all numbers to be printed
+
+        for digit in scoreDigits:
+            totalWidth += images['numbers'][digit].get_width()
+
+        Xoffset = (SCREENWIDTH - totalWidth) / 2
+
+        for digit in scoreDigits:
+            self.surface.blit(images['numbers'][digit], (Xoffset, SCREENHEIGHT * 0.1))
+            Xoffset += images['numbers'][digit].get_width()
+
+    def _draw_player(self, game, images):
+        # Player rotation has a threshold
+        visibleRot = game.playerRotThr
+        if game.playerRot <= game.playerRotThr:
+            visibleRot = game.playerRot
+
+        playerSurface = pygame.transform.rotate(images['player'][game.playerIndex], visibleRot)
+        self.surface.blit(playerSurface, (game.playerx, game.playery + game.player_shm_vals['val']))
@@ -2,33 +2,84 @@ import sys
 import argparse
 from itertools import cycle
 import random
-import pygame
-from pygame.constants import KEYDOWN, K_SPACE, K_UP
 from loguru import logger
 from time import sleep
 
-from gameai.flappy_bird.game.settings import *
+from gameai.flappy_bird.game.core import *
 
 
-parser = argparse.ArgumentParser("learn.py")
-parser.add_argument("--iter", type=int, default=1000,
-                    help="number of iterations to run")
-parser.add_argument(
-    "--verbose", type=bool, default=True, help="output [iteration | score] to stdout"
-)
-parser.add_argument("-d", "--daemon", type=bool, default=False,
-                    help="run in daemon without visualization")
-args = parser.parse_args()
-ITERATIONS = args.iter
-VERBOSE = args.verbose
-DAMEON = args.daemon
+ITERATIONS = 1000
+VERBOSE = True
+DAMEON = False
 
 PLAYER_INDEX_GEN = cycle([0, 1, 2, 1])
 
 
+class GameSnapshot(object):
+    """
+    The state of a Game that changes while it is played, see Game.snapshot.
+    pipes holds (upper x, upper y, lower x, lower y) of every pipe, pipeGaps
+    the game's pipe course, not copied.
+    """
+    __slots__ = ('score', 'playerIndex', 'loopIter', 'playery', 'basex', 'pipes', 'shm', 'playerVelY',
+                 'playerRot', 'playerFlapped', 'pipeIndex', 'pipeGaps', 'rngState')
+
+    def __init__(self, score, playerIndex, loopIter, playery, basex, pipes, shm, playerVelY, playerRot,
+                 playerFlapped, pipeIndex, pipeGaps, rngState) -> None:
+        self.score = score
+        self.playerIndex = playerIndex
+        self.loopIter = loopIter
+        self.playery = playery
+        self.basex = basex
+        self.pipes = pipes
+        self.shm = shm
+        self.playerVelY = playerVelY
+        self.playerRot = playerRot
+        self.playerFlapped = playerFlapped
+        self.pipeIndex = pipeIndex
+        self.pipeGaps = pipeGaps
+        self.rngState = rngState
+
+
 class Game(object):
-    def __init__(self, iter_loop: int=0, daemon=False) -> None:
+    def __init__(self, iter_loop: int=0, daemon=False, assets=None, fps=FPS, show_every=1,
+                 obs_mode='rgb', seed=None, pipe_gaps=None, verbose=True) -> None:
+        """
+        daemon: run headless, without display, sounds or pygame
+        assets: settings.AssetManager with the skins and audio to render
+                with, a random skin with sounds when None
+        fps: frame rate cap of the window, None to render at full speed
+        show_every: show every Kth rendered frame in the window, 0 renders
+                    off-screen only
+        obs_mode: 'rgb', 'buffer' or 'gray', the frames frame_step returns,
+                  see render.Renderer. The last two reuse one array that
+                  the next frame_step overwrites.
+        seed: seed of the game's own random generator, the same seed
+              gives the same pipes, headless or rendered
+        pipe_gaps: gap y of the pipes to play instead of random ones, e.g.
+                   core.randomPipeGaps. every episode replays them from the
+                   first, cycling when they run out
+        verbose: log the score of every game when the module's VERBOSE is set
+        """
         self.daemon = daemon
+        self.verbose = verbose
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # state of self.rng, None once it changed since it was last taken
+        self._rngState = None
+        self.pipe_gaps = pipe_gaps
+        # pygame is only needed to visualize the game
+        self.renderer = None
+        if not daemon:
+            from gameai.flappy_bird.game.render import Renderer
+            from gameai.flappy_bird.game.settings import AssetManager
+            if assets is None:
+                # a generator of its own, the skins do not change the pipes
+                assets = AssetManager(rng=random.Random(seed))
+            self.renderer = Renderer(assets=assets, fps=fps, show_every=show_every, obs_mode=obs_mode)
+        self.reset(iter_loop=iter_loop)
+
+    def reset(self, iter_loop: int=0) -> None:
         self.score = 0
         # index of player to blit on screen
         self.playerIndex = 0
@@ -39,11 +90,13 @@ class Game(object):
         self.playery = int((SCREENHEIGHT - PLAYER_HEIGHT) / 2)
         self.basex = 0
         # amount by which base can maximum shift to left
-        self.baseShift = IMAGES['base'].get_width() - BACKGROUND_WIDTH
+        self.baseShift = BASE_WIDTH - BACKGROUND_WIDTH
 
+        # next gap of pipe_gaps
+        self.pipeIndex = 0
         # get 2 new pipes to add to upperPipes lowerPipes list
-        newPipe1 = getRandomPipe()
-        newPipe2 = getRandomPipe()
+        newPipe1 = self._new_pipe()
+        newPipe2 = self._new_pipe()
         # list of upper pipes
         self.upperPipes = [
             {'x': SCREENWIDTH + 200, 'y': newPipe1[0]['y']},
@@ -69,11 +122,53 @@ class Game(object):
         self.playerFlapAcc = -9      # players speed on flapping
         self.playerFlapped = False   # True when player flaps
 
+    def snapshot(self):
+        """
+        returns a GameSnapshot of the game, to go back to it with restore.
+        the renderer is not part of it, search on a daemon game.
+        """
+        if self._rngState is None:
+            # the generator only changes when a pipe is drawn, snapshots in between share its state
+            self._rngState = self.rng.getstate()
+        shm = self.player_shm_vals
+        return GameSnapshot(
+            self.score, self.playerIndex, self.loopIter, self.playery, self.basex,
+            tuple([(u['x'], u['y'], l['x'], l['y']) for u, l in zip(self.upperPipes, self.lowerPipes)]),
+            (shm['val'], shm['dir']), self.playerVelY, self.playerRot, self.playerFlapped, self.pipeIndex,
+            self.pipe_gaps, self._rngState,
+        )
+
+    def restore(self, snapshot):
+        """
+        puts the game back in the state of a snapshot, of this game or another
+        one. the game goes on with the pipe course of the snapshot's game.
+        """
+        self.score = snapshot.score
+        self.playerIndex = snapshot.playerIndex
+        self.loopIter = snapshot.loopIter
+        self.playery = snapshot.playery
+        self.basex = snapshot.basex
+        self.upperPipes = [{'x': ux, 'y': uy} for ux, uy, _, _ in snapshot.pipes]
+        self.lowerPipes = [{'x': lx, 'y': ly} for _, _, lx, ly in snapshot.pipes]
+        self.player_shm_vals = {'val': snapshot.shm[0], 'dir': snapshot.shm[1]}
+        self.playerVelY = snapshot.playerVelY
+        self.playerRot = snapshot.playerRot
+        self.playerFlapped = snapshot.playerFlapped
+        self.pipeIndex = snapshot.pipeIndex
+        self.pipe_gaps = snapshot.pipeGaps
+        if snapshot.rngState is not self._rngState:
+            self.rng.setstate(snapshot.rngState)
+            self._rngState = snapshot.rngState
+
     def main_play(self):
         if self.daemon:
             # TODO
             return
 
+        import pygame
+        from pygame.constants import KEYDOWN, K_SPACE, K_UP
+        from gameai.flappy_bird.game.settings import quit_game
+
         while True:
             input_actions = [1, 0]
             for event in pygame.event.get():
@@ -85,13 +180,14 @@ class Game(object):
                     # if self.playery > 0:
                         self.playerVelY = self.playerFlapAcc
                         self.playerFlapped = True
-                        SOUNDS['wing'].play()
+                        self.renderer.play('wing')
                         input_actions = [0, 1]
 
             self.frame_step(input_actions)
 
     def frame_step(self, input_actions):
-        pygame.event.pump()
+        if not self.daemon:
+            self.renderer.pump()
         reward = 0.1
         terminal = False
 
@@ -105,14 +201,14 @@ class Game(object):
                 self.playerVelY = self.playerFlapAcc
                 self.playerFlapped = True
                 if not self.daemon:
-                    SOUNDS['wing'].play()
+                    self.renderer.play('wing')
 
         is_crashed = self._check_player_crash()
         if is_crashed:
             terminal = True
             reward = -1
             if not self.daemon:
-                SCREEN.blit(IMAGES['gameover'], (50, 180))
+                self.renderer.gameover()
 
         if self.playery < -15:
             reward = -0.1
@@ -124,15 +220,11 @@ class Game(object):
         self._move_player()
         self._move_pipes_to_left()
         if not self.daemon:
-            self._draw_sprites()
-            self._draw_score()
-            self._draw_player()
+            self.renderer.draw(self)
         playerShm(self.player_shm_vals)
 
         if not self.daemon:
-            image_data = pygame.surfarray.array3d(pygame.display.get_surface())
-            pygame.display.update()
-            FPSCLOCK.tick(FPS)
+            image_data = self.renderer.update()
         else:
             image_data = None
 
@@ -145,13 +237,13 @@ class Game(object):
                                self.upperPipes, self.lowerPipes)
         if crashTest[0]:
             if not self.daemon:
-                SOUNDS['hit'].play()
-                SOUNDS['die'].play()
-            if VERBOSE:
+                self.renderer.play('hit')
+                self.renderer.play('die')
+            if VERBOSE and self.verbose:
                 self.print_iteration()
             # 重新初始化
             iteration = self.loopIter + 1
-            self.__init__(iter_loop=iteration)
+            self.reset(iter_loop=iteration)
 
         # rotate only when it's a pipe crash
         if not crashTest[1] and self.playerRot > -30:
@@ -168,7 +260,7 @@ class Game(object):
             if pipeMidPos <= playerMidPos < pipeMidPos + 4:
                 self.score += 1
                 if not self.daemon:
-                    SOUNDS['point'].play()
+                    self.renderer.play('point')
                 is_scored = True
         return is_scored
 
@@ -195,8 +287,15 @@ class Game(object):
             self.playerRot = 15
 
         # player's movement in y axis: move up in v_y or to top ceil
-        player_height = IMAGES['player'][self.playerIndex].get_height()
-        self.playery += min(self.playerVelY, BASEY - self.playery - player_height)
+        self.playery += min(self.playerVelY, BASEY - self.playery - PLAYER_HEIGHT)
+
+    def _new_pipe(self):
+        if self.pipe_gaps is None:
+            self._rngState = None
+            return getRandomPipe(self.rng)
+        gapY = int(self.pipe_gaps[self.pipeIndex % len(self.pipe_gaps)])
+        self.pipeIndex += 1
+        return pipesAt(gapY)
 
     def _move_pipes_to_left(self):
         # move pipes to left
@@ -206,7 +305,7 @@ class Game(object):
 
         # add new pipe when first pipe is about to touch left of screen
         if len(self.upperPipes) > 0 and 0 < self.upperPipes[0]['x'] < 5:
-            newPipe = getRandomPipe()
+            newPipe = self._new_pipe()
             self.upperPipes.append(newPipe[0])
             self.lowerPipes.append(newPipe[1])
 
@@ -215,39 +314,6 @@ class Game(object):
             self.upperPipes.pop(0)
             self.lowerPipes.pop(0)
 
-    def _draw_sprites(self):
-        # draw sprites
-        SCREEN.blit(IMAGES['background'], (0, 0))
-
-        for uPipe, lPipe in zip(self.upperPipes, self.lowerPipes):
-            SCREEN.blit(IMAGES['pipe'][0], (uPipe['x'], uPipe['y']))
-            SCREEN.blit(IMAGES['pipe'][1], (lPipe['x'], lPipe['y']))
-
-        SCREEN.blit(IMAGES['base'], (self.basex, BASEY))
-
-    def _draw_score(self):
-        """displays score in center of screen"""
-        scoreDigits = [int(x) for x in list(str(self.score))]
-        totalWidth = 0   # total width of all numbers to be printed
-
-        for digit in scoreDigits:
-            totalWidth += IMAGES['numbers'][digit].get_width()
-
-        Xoffset = (SCREENWIDTH - totalWidth) / 2
-
-        for digit in scoreDigits:
-            SCREEN.blit(IMAGES['numbers'][digit], (Xoffset, SCREENHEIGHT * 0.1))
-            Xoffset += IMAGES['numbers'][digit].get_width()
-
-    def _draw_player(self):
-        # Player rotation has a threshold
-        visibleRot = self.playerRotThr
-        if self.playerRot <= self.playerRotThr:
-            visibleRot = self.playerRot
-
-        playerSurface = pygame.transform.rotate(IMAGES['player'][self.playerIndex], visibleRot)
-        SCREEN.blit(playerSurface, (self.playerx, self.playery + self.player_shm_vals['val']))
-
     def print_iteration(self):
         logger.debug(f'Iteration: {self.loopIter} | score: {self.score}')
 
@@ -257,5 +323,18 @@ class Game(object):
 
 
 if __name__ == '__main__':
-    g = Game(daemon=self.daemon)
-    g.main_play()
\ No newline at end of file
+    parser = argparse.ArgumentParser("learn.py")
+    parser.add_argument("--iter", type=int, default=1000,
+                        help="number of iterations to run")
+    parser.add_argument(
+        "--verbose", type=bool, default=True, help="output [iteration | score] to stdout"
+    )
+    parser.add_argument("-d", "--daemon", type=bool, default=False,
+                        help="run in daemon without visualization")
+    args = parser.parse_args()
+    ITERATIONS = args.iter
+    VERBOSE = args.verbose
+    DAMEON = args.daemon
+
+    g = Game(daemon=DAMEON)
+    g.main_play()
@@ -0,0 +1,169 @@
+import numpy as np
+
+from gameai.flappy_bird.game import core
+from gameai.flappy_bird.game.core import (
+    SCREENWIDTH, SCREENHEIGHT, PIPEGAPSIZE, BASEY,
+    PLAYER_WIDTH, PLAYER_HEIGHT, PIPE_WIDTH, PIPE_HEIGHT,
+    randomPipeGaps,
+)
+
+# at most 3 pipes are on screen: a new one spawns at x=298 when the first
+# reaches x<5, and the first is dropped once it passes x<-PIPE_WIDTH
+MAX_PIPES = 3
+
+
+class VectorGame(object):
+    """
+    N headless Flappy Bird games stepped in lockstep.
+
+    Follows the rules of `Game.frame_step` but keeps the state of every game
+    in NumPy arrays, so one `step` call advances all of them. Finished games
+    are reset in place, the same way `Game` reinitializes itself on a crash.
+
+    pipe_gaps: gap y of the pipes every game plays instead of random ones,
+               replayed from the first each episode like Game(pipe_gaps=...)
+    """
+    def __init__(self, num_envs: int, seed=None, collision=None, pipe_gaps=None) -> None:
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+        self.pipe_gaps = np.asarray(pipe_gaps, dtype=np.int64) if pipe_gaps is not None else None
+        # CollisionEngine or CollisionTable, the one checkCrash uses by default
+        self.collision = collision if collision is not None else core.COLLISION
+
+        self.playerx = int(SCREENWIDTH * 0.2)
+        self.playerIndex = 0
+        self.pipeVelX = -4
+        self.playerMaxVelY = 10
+        self.playerAccY = 1
+        self.playerVelRot = 3
+        self.playerFlapAcc = -9
+
+        self.playery = np.zeros(num_envs, dtype=np.float64)
+        self.playerVelY = np.zeros(num_envs, dtype=np.int64)
+        self.playerRot = np.zeros(num_envs, dtype=np.int64)
+        self.score = np.zeros(num_envs, dtype=np.int64)
+        # score of the last finished episode, and number of finished episodes
+        self.final_score = np.zeros(num_envs, dtype=np.int64)
+        self.episodes = np.zeros(num_envs, dtype=np.int64)
+
+        # x and upper pipe y of each pipe on screen, only the first
+        # pipe_count slots of a row are valid. lower pipe y is derived.
+        self.pipe_x = np.zeros((num_envs, MAX_PIPES), dtype=np.int64)
+        self.pipe_y = np.zeros((num_envs, MAX_PIPES), dtype=np.int64)
+        self.pipe_count = np.zeros(num_envs, dtype=np.int64)
+        # next gap of pipe_gaps of each game
+        self.pipe_index = np.zeros(num_envs, dtype=np.int64)
+
+        self.reset(np.ones(num_envs, dtype=bool))
+
+    @property
+    def lower_pipe_y(self):
+        return self.pipe_y + PIPE_HEIGHT + PIPEGAPSIZE
+
+    def _new_pipe_y(self, envs, n=1):
+        """upper pipe y of the next `n` pipes of the games `envs`, a (len(envs), n) array"""
+        if self.pipe_gaps is None:
+            gapY = randomPipeGaps((len(envs), n), self.rng)
+        else:
+            course = self.pipe_index[envs, None] + np.arange(n)
+            gapY = self.pipe_gaps[course % len(self.pipe_gaps)]
+            self.pipe_index[envs] += n
+        return gapY - PIPE_HEIGHT
+
+    def reset(self, mask):
+        """reinitializes the games selected by the bool array `mask`"""
+        envs = np.flatnonzero(mask)
+        if len(envs) == 0:
+            return
+        self.playery[mask] = int((SCREENHEIGHT - PLAYER_HEIGHT) / 2)
+        self.playerVelY[mask] = -9
+        self.playerRot[mask] = 15
+        self.score[mask] = 0
+        self.pipe_x[mask, 0] = SCREENWIDTH + 200
+        self.pipe_x[mask, 1] = SCREENWIDTH + 200 + SCREENWIDTH // 2
+        self.pipe_index[envs] = 0
+        self.pipe_y[envs, :2] = self._new_pipe_y(envs, 2)
+        self.pipe_count[mask] = 2
+
+    def step(self, actions):
+        """
+        advances every game by one frame.
+
+        actions: (N,) array, 1 to flap and 0 to do nothing
+        returns: (N,) reward and (N,) terminal arrays
+        """
+        actions = np.asarray(actions)
+        if actions.shape != (self.num_envs,):
+            raise ValueError(f'Expected actions of shape ({self.num_envs},), got {actions.shape}')
+        reward = np.full(self.num_envs, 0.1)
+
+        flapped = (actions == 1) & (self.playery > -2 * PLAYER_HEIGHT)
+        self.playerVelY[flapped] = self.playerFlapAcc
+
+        ground, crashed = self._check_crash()
+        if crashed.any():
+            self.final_score[crashed] = self.score[crashed]
+            self.episodes[crashed] += 1
+            self.reset(crashed)
+            flapped &= ~crashed
+        # rotate only when it's a pipe crash
+        self.playerRot[~ground & (self.playerRot > -30)] -= self.playerVelRot
+
+        reward[crashed] = -1
+        reward[self.playery < -15] = -0.1
+        reward[self._check_score()] = 1
+
+        self._move_player(flapped)
+        self._move_pipes_to_left()
+
+        return reward, crashed
+
+    def _valid_pipes(self):
+        return np.arange(MAX_PIPES)[None, :] < self.pipe_count[:, None]
+
+    def _check_crash(self):
+        """returns bool arrays of ground crashes and of all crashes"""
+        ground = self.playery + PLAYER_HEIGHT >= BASEY - 1
+
+        # every bird against each of its own pipes, upper and lower
+        dx = self.playerx - self.pipe_x
+        dy = self.playery.astype(np.int64)[:, None] - self.pipe_y
+        hit = self.collision.collide_batch(self.playerIndex, 0, dx, dy)
+        hit |= self.collision.collide_batch(self.playerIndex, 1, dx, dy - PIPE_HEIGHT - PIPEGAPSIZE)
+
+        crashed = ground | (hit & self._valid_pipes()).any(axis=1)
+        return ground, crashed
+
+    def _check_score(self):
+        playerMidPos = self.playerx + PLAYER_WIDTH // 2
+        pipeMidPos = self.pipe_x + PIPE_WIDTH // 2
+        passed = (pipeMidPos <= playerMidPos) & (playerMidPos < pipeMidPos + 4) & self._valid_pipes()
+        self.score += passed.sum(axis=1)
+        return passed.any(axis=1)
+
+    def _move_player(self, flapped):
+        self.playerRot[self.playerRot > -30] -= self.playerVelRot
+
+        falling = ~flapped & (self.playerVelY < self.playerMaxVelY)
+        self.playerVelY[falling] += self.playerAccY
+        self.playerRot[flapped] = 15
+
+        self.playery += np.minimum(self.playerVelY, BASEY - self.playery - PLAYER_HEIGHT)
+
+    def _move_pipes_to_left(self):
+        self.pipe_x += self.pipeVelX
+
+        # add new pipe when first pipe is about to touch left of screen
+        spawn = np.nonzero((0 < self.pipe_x[:, 0]) & (self.pipe_x[:, 0] < 5))[0]
+        if len(spawn):
+            slots = self.pipe_count[spawn]
+            self.pipe_x[spawn, slots] = SCREENWIDTH + 10
+            self.pipe_y[spawn, slots] = self._new_pipe_y(spawn)[:, 0]
+            self.pipe_count[spawn] += 1
+
+        # remove first pipe if its out of the screen
+        gone = self.pipe_x[:, 0] < -PIPE_WIDTH
+        if gone.any():
+            self.pipe_x[gone, :-1] = self.pipe_x[gone, 1:]
+            self.pipe_y[gone, :-1] = self.pipe_y[gone, 1:]
+            self.pipe_count[gone] -= 1
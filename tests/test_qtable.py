@@ -0,0 +1,81 @@
+import os
+import shutil
+import numpy as np
+import pytest
+
+from gameai.flappy_bird.ai.qtable import QTable, STATES, ACTIONS
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'qvalues.bin')
+    table = QTable(np.arange(STATES * ACTIONS, dtype=np.float64).reshape(STATES, ACTIONS))
+    table.save(path)
+    return path
+
+
+def log_rows(table, path, rows, value):
+    table.values[rows] = value
+    table.append_log(rows, path)
+
+
+def test_log_round_trip(path):
+    table = QTable.load(path)
+    log_rows(table, path, [3, 5], -1.)
+    log_rows(table, path, [5, 7], -2.)
+    loaded = QTable.load(path)
+    np.testing.assert_array_equal(loaded.values, table.values)
+    assert loaded.values[5].tolist() == [-2., -2.]
+
+
+def test_torn_record_is_cut(path):
+    table = QTable.load(path)
+    log_rows(table, path, [3], -1.)
+    # a crash in the middle of the next record
+    with open(QTable.log_path(path), 'ab') as f:
+        f.write((1000).to_bytes(4, 'little') + b'\x00' * 10)
+
+    table = QTable.load(path)
+    assert table.values[3].tolist() == [-1., -1.]
+    log_rows(table, path, [9], -3.)
+    loaded = QTable.load(path)
+    assert loaded.values[9].tolist() == [-3., -3.]
+    np.testing.assert_array_equal(loaded.values, table.values)
+
+
+def test_torn_record_is_cut_on_append(path):
+    table = QTable.load(path)
+    log_rows(table, path, [3], -1.)
+    with open(QTable.log_path(path), 'ab') as f:
+        f.write(b'\x01\x00')
+    log_rows(table, path, [9], -3.)
+    np.testing.assert_array_equal(QTable.load(path).values, table.values)
+
+
+def test_stale_log_is_started_over(path):
+    table = QTable.load(path)
+    log_rows(table, path, [3], -1.)
+    stale = path + '.stale'
+    shutil.copy(QTable.log_path(path), stale)
+    table.save(path)
+    # a crash in between replacing the file and removing its old log
+    shutil.copy(stale, QTable.log_path(path))
+
+    loaded = QTable.load(path)
+    log_rows(loaded, path, [9], -3.)
+    np.testing.assert_array_equal(QTable.load(path).values, loaded.values)
+
+    # appending to a stale log without loading it first
+    shutil.copy(stale, QTable.log_path(path))
+    log_rows(loaded, path, [11], -4.)
+    assert QTable.load(path).values[11].tolist() == [-4., -4.]
+
+
+def test_read_only_load_keeps_the_log(path):
+    table = QTable.load(path)
+    log_rows(table, path, [3], -1.)
+    with open(QTable.log_path(path), 'ab') as f:
+        f.write(b'\x01\x00')
+    size = os.path.getsize(QTable.log_path(path))
+    assert QTable.load(path, mode='r').values[3].tolist() == [-1., -1.]
+    assert os.path.getsize(QTable.log_path(path)) == size